@@ -6,12 +6,19 @@ Creates a decision tree using ID3 and uses pre-pruning to get better accuracy. C
 "types" attribute
 """
 import math
-from typing import Dict, List, Set
-from collections import Counter
+import multiprocessing
+import random
+from array import array
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from collections import Counter, deque
+from itertools import chain, repeat
+from operator import add, and_, eq, or_
 from dataclasses import dataclass
+from dataStats import countsEntropy, countsGain
 
 
-@dataclass
+@dataclass(slots=True)
 # Represents a node in the decision tree
 class Node:
     # the splitting attribute at this node
@@ -22,112 +29,734 @@ class Node:
     value: str = None
     # dictionary mapping attribute values to child nodes
     children: Dict[str, 'Node'] = None
+    # most common class of the training rows that reached this node, used for values it has no child for
+    default: str = None
+    # numeric splits send values <= threshold to children['<='] and the rest to children['>']
+    threshold: float = None
+    # how many training rows reached a split (see ID3.truncate)
+    samples: int = 0
 
     def __post_init__(self):
         if self.children is None:
             self.children = {}
+        if self.default is None:
+            self.default = self.value
+
+
+# A trained tree flattened into arrays, node 0 is the root:
+#   attributeIndex[node]  which of the tree's attributes the node splits on, -1 for leaves
+#   classCode[node]       class of a leaf, or the default class of a split
+#   childStart[node]      where the node's block starts in childTable
+#   childTable            per split one entry per code of its attribute plus one on the end for missing
+#                         values (code -1), giving the child node or -1 for the split's default class
+#   thresholds[node]      threshold of a numeric split (nan otherwise), whose rows get code 0 for <= and
+#                         1 for >, so its block is [<= child, > child, -1]
+class CompiledTree:
+    def __init__(self, tree: Node, dictionaries: Dict, targetDictionary):
+        self.dictionaries = dictionaries
+        self.targetDictionary = targetDictionary
+        self.attributeIndex = array('i')
+        self.classCode = array('i')
+        self.childStart = array('i')
+        self.childTable = array('i')
+        self.thresholds = array('d')
+        # only the attributes the tree splits on, in the order they are first used
+        self.attributes: List[str] = []
+        # how many codes each attribute had when the tree was compiled (2 for numeric attributes)
+        self.widths: List[int] = []
+        self.numeric: List[bool] = []
+
+        # nodes are numbered breadth first
+        nodes = [tree]
+        for node in nodes:
+            self.childStart.append(len(self.childTable))
+            self.thresholds.append(math.nan if node.threshold is None else node.threshold)
+            if node.isLeaf:
+                self.attributeIndex.append(-1)
+                self.classCode.append(targetDictionary.lookup(node.value))
+                continue
+            numeric = node.threshold is not None
+            if node.attribute not in self.attributes:
+                self.attributes.append(node.attribute)
+                self.widths.append(2 if numeric else len(dictionaries[node.attribute]))
+                self.numeric.append(numeric)
+            index = self.attributes.index(node.attribute)
+            self.attributeIndex.append(index)
+            self.classCode.append(targetDictionary.lookup(node.default))
+            block = array('i', [-1]) * (self.widths[index] + 1)
+            for value, child in node.children.items():
+                code = ('<=', '>').index(value) if numeric else dictionaries[node.attribute].lookup(value)
+                block[code] = len(nodes)
+                nodes.append(child)
+            self.childTable.extend(block)
+
+    def __len__(self):
+        return len(self.attributeIndex)
+
+    # The code column of every attribute the tree uses, in the codes the tree was trained with
+    # (codes the tree has never seen become -1, like missing values)
+    # Numeric attributes give (values, missing) instead, with missing -1 for missing values and 0 otherwise
+    def _columns(self, data) -> List:
+        columns = []
+        for name, width, numeric in zip(self.attributes, self.widths, self.numeric):
+            if numeric:
+                column = data.featureData[name]
+                columns.append((column.values.tolist(), [-missing for missing in column.missing]))
+                continue
+            codes = data.featureData[name].codes
+            dictionary = self.dictionaries[name]
+            if data.dictionaries[name] is not dictionary:
+                # data wasn't loaded with the training data as reference, its codes need translating
+                remap = [dictionary.lookup(value) for value in data.dictionaries[name].values]
+            elif len(dictionary) > width:
+                remap = list(range(len(dictionary)))
+            else:
+                # plain lists are quicker to index than arrays
+                columns.append(array('i', codes).tolist())
+                continue
+            remap = [code if 0 <= code < width else -1 for code in remap] + [-1]
+            columns.append(list(map(remap.__getitem__, codes)))
+        return columns
+
+    # Routes every row of data through the tree, giving back the predicted class codes
+    # Rows go down a whole group at a time: each split sends its rows to its children's lists in one
+    # pass, with map doing the work instead of a Python loop
+    def predictCodes(self, data) -> array:
+        columns = self._columns(data)
+        rowCount = data.rowCount()
+        attributeIndex, classCode, childStart = self.attributeIndex, self.classCode, self.childStart
+        thresholds = self.thresholds
+        childTable = self.childTable.tolist()
+
+        # (rows, class code) for every group of rows that reached a leaf or a split's default
+        finished = []
+        pending = [(0, range(rowCount))]
+        while pending:
+            node, rows = pending.pop()
+            index = attributeIndex[node]
+            if index < 0:
+                finished.append((rows, classCode[node]))
+                continue
+            start = childStart[node]
+            block = childTable[start:start + self.widths[index] + 1]
+            groups = {child: [] for child in block}
+            # the list each code's rows go in, code -1 (missing) picks the last one
+            codeGroups = [groups[child] for child in block]
+            if self.numeric[index]:
+                # (threshold < value) is 1 for the > side, or-ing in -1 makes missing values -1
+                values, missing = columns[index]
+                codes = map(or_, map(thresholds[node].__lt__, map(values.__getitem__, rows)),
+                            map(missing.__getitem__, rows))
+            else:
+                codes = map(columns[index].__getitem__, rows)
+            deque(map(list.append, map(codeGroups.__getitem__, codes), rows), maxlen=0)
+            for child, group in groups.items():
+                if not group:
+                    continue
+                if child < 0:
+                    finished.append((group, classCode[node]))
+                else:
+                    pending.append((child, group))
+
+        predictions = [-1] * rowCount
+        for rows, code in finished:
+            deque(map(predictions.__setitem__, rows, repeat(code)), maxlen=0)
+        return array('i', predictions)
+
+    # Predicted class of every row in data
+    def predictBatch(self, data) -> List[str]:
+        return list(map(self.targetDictionary.values.__getitem__, self.predictCodes(data)))
+
+
+# The model every worker process of parallelBuild works with
+_workerModel = None
+
+
+def _initWorker(model: 'ID3'):
+    global _workerModel
+    _workerModel = model
+
+
+# Class counts and the splits of every attribute for some rows (run in a worker)
+def _nodeGains(rows: array, sortedRows: Dict[str, array], attributes: List[str]):
+    return _workerModel.nodeGains(rows, sortedRows, attributes)
+
+
+# Builds the whole subtree for some rows, sortedRows being the same rows sorted by each numeric
+# attribute (run in a worker)
+def _buildSubtree(rows: array, sortedRows: Dict[str, array], attributes: List[str], depth: int) -> Node:
+    _workerModel.order = rows
+    _workerModel.sortedOrders = sortedRows
+    return _workerModel.buildTree(0, len(rows), attributes, depth)
+
+
+# Swaps the subtrees still being built in workers for the finished ones
+def _collectSubtrees(node):
+    if isinstance(node, Future):
+        return node.result()
+    for value, child in node.children.items():
+        node.children[value] = _collectSubtrees(child)
+    return node
 
 
 class ID3:
     # Initialize ID3 with data and target attributes
-    def __init__(self, data, targetAttribute: str, maxDepth=10, minSamples=5):
+    # attributesPerNode makes every node pick the best split from that many attributes drawn at random
+    # (seeded by seed) instead of from all of them, the way the trees of a random forest are grown
+    def __init__(self, data, targetAttribute: str, maxDepth=10, minSamples=5, attributesPerNode: Optional[int] = None,
+                 seed=None):
         self.data = data
         self.targetAttribute = targetAttribute
         self.maxDepth = maxDepth
         self.minSamples = minSamples
-        # makes sure no numerical attributes are there
-        for attr, attrType in data.attributes.items():
-            if 'numeric' in attrType:
-                raise ValueError(f"Numerical attribute '{attr}' found. This only supports discrete attributes.")
-        # get all attributes except the target
-        self.attributes = set(data.attributes.keys()) - {targetAttribute}
+        self.attributesPerNode = attributesPerNode
+        self.random = random.Random(seed)
+        # the target has to be discrete, numeric descriptive attributes are split on a threshold
+        if data.getFeatureType(targetAttribute) == 'numeric':
+            raise ValueError(f"Target attribute '{targetAttribute}' is numeric. This only supports discrete "
+                             f"targets (bin it first with discretizer.Discretizer).")
+        # get all attributes except the target, in the order they were declared so ties between
+        # equally good splits always go the same way
+        self.attributes = [attr for attr in data.attributes if attr != targetAttribute]
+        self.numericAttributes = {attr for attr in self.attributes if data.getFeatureType(attr) == 'numeric'}
+        # work on the integer codes of each column instead of comparing strings, and on the values and
+        # missing flags of numeric columns (fetched once, sparse columns build them on every access)
+        featureData = data.featureData
+        self.columns = {attr: featureData[attr].values if attr in self.numericAttributes else featureData[attr].codes
+                        for attr in self.attributes}
+        self.missing = {attr: featureData[attr].missing for attr in self.numericAttributes}
+        self.targetCodes = featureData[targetAttribute].codes
+        self.targetDictionary = data.dictionaries[targetAttribute]
+        self.xlogx = [0.0]
 
     # Calculates the entropy for a set of data indiecs
     def entropy(self, dataIndices: List[int]) -> float:
-        targetValues = [self.data.featureData[self.targetAttribute][i] for i in dataIndices]
-        counts = Counter(targetValues)
-        total = len(dataIndices)
-        entropy = 0
-        for count in counts.values():
-            prob = count / total
-            entropy -= prob * math.log2(prob)
-        return entropy
+        targetCodes = self.targetCodes
+        return countsEntropy(list(Counter(targetCodes[i] for i in dataIndices).values()))
+
+    # Counts the classes and the (attribute value x class) table of every attribute for a set of rows
+    # Gives back (class code -> count, one value code -> class code -> count table per attribute)
+    def countTables(self, dataIndices: List[int], attributes: List[str]) -> Tuple[Dict, List[Dict]]:
+        columns = [self.columns[attr] for attr in attributes]
+        combinations = len(self.targetDictionary)
+        for attr in attributes:
+            combinations *= len(self.data.dictionaries[attr])
+            if combinations > len(dataIndices):
+                break
+
+        classCounts = {}
+        tables = [{} for _ in attributes]
+        if combinations <= len(dataIndices):
+            # few value combinations: one scan counts every (class, value of each attribute) the rows hold,
+            # and the tables are summed from those counts
+            jointCounts = Counter(zip(map(self.targetCodes.__getitem__, dataIndices),
+                                      *(map(codes.__getitem__, dataIndices) for codes in columns)))
+            for key, count in jointCounts.items():
+                targetCode = key[0]
+                classCounts[targetCode] = classCounts.get(targetCode, 0) + count
+                for table, code in zip(tables, key[1:]):
+                    valueCounts = table.setdefault(code, {})
+                    valueCounts[targetCode] = valueCounts.get(targetCode, 0) + count
+            return classCounts, tables
+
+        # otherwise nearly every row is its own combination, and counting (class, value) pairs one
+        # attribute at a time is quicker than summing a joint table that is as big as the rows
+        # each (class, value) pair is counted as the int class * stride + value + 1, which is quicker than tuples
+        # (the + 1 makes room for the -1 missing code)
+        targets = list(map(self.targetCodes.__getitem__, dataIndices))
+        classCounts.update(Counter(targets))
+        stride = max((len(self.data.dictionaries[attr]) for attr in attributes), default=0) + 1
+        scaledTargets = [targetCode * stride + 1 for targetCode in targets]
+        for table, codes in zip(tables, columns):
+            for key, count in Counter(map(add, scaledTargets, map(codes.__getitem__, dataIndices))).items():
+                targetCode, code = divmod(key, stride)
+                table.setdefault(code - 1, {})[targetCode] = count
+        return classCounts, tables
+
+    # Information gain of splitting rows with these class counts by an attribute with this count table
+    def gainFromCounts(self, classCounts: Dict, table: Dict) -> float:
+        return countsGain(classCounts, table)
+
+    # Finds the best threshold to split some rows on a numeric attribute, given the rows sorted by that
+    # attribute with the missing values at the end. One sweep moves the rows across from the right side to
+    # the left one by one, keeping each side's sum of count * log2(count) up to date so the entropy of every
+    # cut between two distinct values costs the same no matter how many classes there are
+    # Gives back (gain, threshold, how many rows go left), the gain is scaled by the fraction of rows that
+    # have a value, as C4.5 does
+    def thresholdGain(self, sortedRows, attribute: str) -> Tuple[float, Optional[float], int]:
+        missing = self.missing[attribute]
+        total = len(sortedRows)
+        known = total - sum(map(missing.__getitem__, sortedRows))
+        knownRows = sortedRows[:known]
+        values = list(map(self.columns[attribute].__getitem__, knownRows))
+        if known < 2 or values[0] == values[-1]:
+            return 0.0, None, 0
+        # missing class codes (-1) count in the extra slot on the end
+        targets = list(map(self.targetCodes.__getitem__, knownRows))
+        right = [0] * (len(self.targetDictionary) + 1)
+        for code, count in Counter(targets).items():
+            right[code] = count
+        left = [0] * len(right)
+        # count * log2(count) for every count up to known, kept between calls
+        xlogx = self.xlogx
+        if len(xlogx) <= known:
+            xlogx.extend(count * math.log2(count) for count in range(len(xlogx), known + 1))
+        leftSum = 0.0
+        rightSum = sum(xlogx[count] for count in right)
+
+        bestCost = math.inf
+        bestPosition = 0
+        for position in range(1, known):
+            code = targets[position - 1]
+            count = left[code]
+            leftSum += xlogx[count + 1] - xlogx[count]
+            left[code] = count + 1
+            count = right[code]
+            rightSum += xlogx[count - 1] - xlogx[count]
+            right[code] = count - 1
+            if values[position] != values[position - 1]:
+                # known * weighted entropy of cutting here
+                cost = xlogx[position] - leftSum + xlogx[known - position] - rightSum
+                if cost < bestCost:
+                    bestCost = cost
+                    bestPosition = position
+
+        # the gain of the best cut is worked out again from its counts so it isn't off by rounding
+        leftCounts = list(Counter(targets[:bestPosition]).values())
+        rightCounts = list(Counter(targets[bestPosition:]).values())
+        weightedEntropy = (bestPosition * countsEntropy(leftCounts)
+                           + (known - bestPosition) * countsEntropy(rightCounts)) / known
+        gain = known / total * (countsEntropy(list(Counter(targets).values())) - weightedEntropy)
+        threshold = (values[bestPosition - 1] + values[bestPosition]) / 2
+        return gain, threshold, bestPosition
+
+    # Class counts of some rows and how splitting them on each attribute would go, as
+    # (gain, threshold, rows going left) with threshold None for discrete attributes
+    # sortedRows holds the same rows sorted by each numeric attribute
+    def nodeGains(self, dataIndices, sortedRows: Dict, attributes: List[str]) -> Tuple[Dict, List[Tuple]]:
+        discrete = [attr for attr in attributes if attr not in self.numericAttributes]
+        classCounts, tables = self.countTables(dataIndices, discrete)
+        tables = iter(tables)
+        gains = []
+        for attr in attributes:
+            if attr not in self.numericAttributes:
+                gains.append((self.gainFromCounts(classCounts, next(tables)), None, 0))
+            elif len(classCounts) > 1:
+                gains.append(self.thresholdGain(sortedRows[attr], attr))
+            else:
+                # nothing to gain on rows that all have the same class, so the sweep is skipped
+                gains.append((0.0, None, 0))
+        return classCounts, gains
 
     # Calcultes information gain for an attribute
     def informationGain(self, dataIndices: List[int], attribute: str) -> float:
-        # Calculate entropy before split
-        initialEntropy = self.entropy(dataIndices)
-        # Group data indices by attribute values
-        valueIndices = {}
-        for indx in dataIndices:
-            value = self.data.featureData[attribute][indx]
-            valueIndices.setdefault(value, []).append(indx)
-        # Calculates weighted entropy after split
-        weightedEntropy = 0
-        total = len(dataIndices)
-        for indices in valueIndices.values():
-            weight = len(indices) / total
-            weightedEntropy += weight * self.entropy(indices)
-        totalEntropy = initialEntropy - weightedEntropy
-        return totalEntropy
+        classCounts, (table,) = self.countTables(dataIndices, [attribute])
+        return self.gainFromCounts(classCounts, table)
 
     # Return the most common target value in the dataset
     def majorityValue(self, dataIndices: List[int]) -> str:
-        targetValues = [self.data.featureData[self.targetAttribute][i] for i in dataIndices]
-        return Counter(targetValues).most_common(1)[0][0]
+        targetCodes = self.targetCodes
+        code = Counter(targetCodes[i] for i in dataIndices).most_common(1)[0][0]
+        return self.targetDictionary.decode(code)
 
     # Checks to make sure all examples have the same target values
     def allSameClass(self, dataIndices: List[int]) -> bool:
-        return len(set(self.data.featureData[self.targetAttribute][i] for i in dataIndices)) == 1
+        targetCodes = self.targetCodes
+        return len(set(targetCodes[i] for i in dataIndices)) == 1
 
-    # Recursive algorithm to build decision tree
-    def buildTree(self, dataIndices: List[int], availableAttributes: Set[str], depth=0) -> Node:
-        # If all examples have same class, return leaf node
+    # Most common class in a class code -> count table, ties go to the class seen first
+    def majorityFromCounts(self, classCounts: Dict) -> str:
+        code = max(classCounts, key=classCounts.get)
+        return self.targetDictionary.decode(code)
+
+    # Sorts the rows in order[start:end] by their code in one column (a stable counting sort)
+    # The presorted orders of the numeric attributes get the same ranges, and being stable each of them
+    # stays sorted within every range, so no node ever has to sort its rows again
+    # Gives back code -> (start, end) of the rows holding that code
+    def partition(self, start: int, end: int, codes) -> Dict[int, Tuple[int, int]]:
+        # the range is copied once so the rows can be written straight to their place
+        rows = self.order[start:end]
+        rowCodes = list(map(codes.__getitem__, rows))
+        counts = Counter(rowCodes)
+        ranges = {}
+        firstPosition = {}
+        position = start
+        for code in sorted(counts):
+            ranges[code] = (position, position + counts[code])
+            firstPosition[code] = position
+            position += counts[code]
+        self.placeRows(self.order, rows, rowCodes, firstPosition)
+        for sortedOrder in self.sortedOrders.values():
+            rows = sortedOrder[start:end]
+            self.placeRows(sortedOrder, rows, list(map(codes.__getitem__, rows)), firstPosition)
+        return ranges
+
+    # Writes rows back into order with the rows of each code starting at firstPosition[code], in the
+    # order they come in
+    def placeRows(self, order: array, rows, rowCodes: List[int], firstPosition: Dict[int, int]) -> None:
+        nextPosition = dict(firstPosition)
+        for row, code in zip(rows, rowCodes):
+            order[nextPosition[code]] = row
+            nextPosition[code] += 1
+
+    # Splits order[start:end] on a threshold found by thresholdGain: the first leftCount rows of the range
+    # sorted by the attribute go left, the others with a value go right and missing values go with the
+    # bigger side. Gives back the ranges of code 0 (<=) and 1 (>)
+    def thresholdPartition(self, start: int, end: int, attribute: str, leftCount: int) -> Dict[int, Tuple[int, int]]:
+        rows = memoryview(self.sortedOrders[attribute])[start:end]
+        known = len(rows) - sum(map(self.missing[attribute].__getitem__, rows))
+        side = self.side
+        deque(map(side.__setitem__, rows[:leftCount], repeat(0)), maxlen=0)
+        deque(map(side.__setitem__, rows[leftCount:known], repeat(1)), maxlen=0)
+        missingSide = 0 if leftCount >= known - leftCount else 1
+        deque(map(side.__setitem__, rows[known:], repeat(missingSide)), maxlen=0)
+        return self.partition(start, end, side)
+
+    # Recursive algorithm to build decision tree on the rows in order[start:end]
+    def buildTree(self, start: int, end: int, availableAttributes: List[str], depth=0) -> Node:
+        # a view of the node's rows, not a copy
+        dataIndices = memoryview(self.order)[start:end]
         # Added pruning
         # Check pruning conditions
-        if (depth >= self.maxDepth or len(
-                dataIndices) < self.minSamples or not availableAttributes or self.allSameClass(dataIndices)):
+        if depth >= self.maxDepth or len(dataIndices) < self.minSamples or not availableAttributes:
             return Node(isLeaf=True, value=self.majorityValue(dataIndices))
-        # Find best attribute to split on
-        bestGain = -1
-        bestAttribute = None
-        for attr in availableAttributes:
-            gain = self.informationGain(dataIndices, attr)
-            if gain > bestGain:
-                bestGain = gain
-                bestAttribute = attr
+        # One scan of the rows counts everything the gains of the discrete attributes need, and one sweep
+        # of each numeric attribute's sorted rows finds its best threshold
+        sortedRows = {attr: memoryview(order)[start:end] for attr, order in self.sortedOrders.items()}
+        candidates = self.candidateAttributes(availableAttributes)
+        classCounts, gains = self.nodeGains(dataIndices, sortedRows, candidates)
+        # If all examples have same class, return leaf node
+        if len(classCounts) == 1:
+            return Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
+        return self.split(start, end, availableAttributes, depth, classCounts, gains, self.buildTree, candidates)
+
+    # The attributes a node picks its split from: all the available ones, or attributesPerNode of them
+    # drawn at random
+    def candidateAttributes(self, availableAttributes: List[str]) -> List[str]:
+        if self.attributesPerNode is None or self.attributesPerNode >= len(availableAttributes):
+            return availableAttributes
+        chosen = set(self.random.sample(availableAttributes, self.attributesPerNode))
+        # kept in declaration order so ties still go to the attribute declared first
+        return [attr for attr in availableAttributes if attr in chosen]
+
+    # Splits the rows in order[start:end] on the attribute with the best gain (or makes a leaf when nothing
+    # gains anything), building each child with buildChild(start, end, remainingAttributes, depth)
+    # gains holds the (gain, threshold, rows going left) from nodeGains of every candidate attribute, by
+    # default all of availableAttributes
+    def split(self, start: int, end: int, availableAttributes: List[str], depth: int, classCounts: Dict,
+              gains: List[Tuple], buildChild, candidates: Optional[List[str]] = None) -> Node:
+        if candidates is None:
+            candidates = availableAttributes
+        bestGain, bestAttribute, bestThreshold, bestLeftCount = self.bestSplit(candidates, gains)
         # if no info gain make this a leaf node
         if bestGain <= 0:
-            return Node(isLeaf=True, value=self.majorityValue(dataIndices))
+            return Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
+        # A numeric attribute splits in two and can be split on again further down
+        if bestThreshold is not None:
+            node = Node(attribute=bestAttribute, default=self.majorityFromCounts(classCounts),
+                        threshold=bestThreshold, samples=end - start)
+            childRanges = self.thresholdPartition(start, end, bestAttribute, bestLeftCount)
+            node.children['<='] = buildChild(*childRanges[0], availableAttributes, depth + 1)
+            node.children['>'] = buildChild(*childRanges[1], availableAttributes, depth + 1)
+            return node
         # Create a node for this split
-        node = Node(attribute=bestAttribute)
+        node = Node(attribute=bestAttribute, default=self.majorityFromCounts(classCounts), samples=end - start)
         # Create child nodes for each value of the best attribute
+        childRanges = self.partition(start, end, self.columns[bestAttribute])
+        dictionary = self.data.dictionaries[bestAttribute]
+        remainingAttributes = [attr for attr in availableAttributes if attr != bestAttribute]
         for value in self.data.discreteValues[bestAttribute]:
-            childIndices = [i for i in dataIndices if self.data.featureData[bestAttribute][i] == value]
+            childRange = childRanges.get(dictionary.lookup(value))
             # if no examples in this value create leaf with majority class
-            if not childIndices:
-                node.children[value] = Node(isLeaf=True, value=self.majorityValue(dataIndices))
+            if childRange is None:
+                node.children[value] = Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
             # recursively build subtree
             else:
-                remainingAttributes = availableAttributes - {bestAttribute}
-                node.children[value] = self.buildTree(childIndices, remainingAttributes, depth + 1)
+                node.children[value] = buildChild(*childRange, remainingAttributes, depth + 1)
         return node
 
-    # train the decision tree on the full dataset
-    def train(self) -> Node:
-        dataIndices = list(range(len(self.data.featureData[self.targetAttribute])))
-        return self.buildTree(dataIndices, self.attributes)
+    # Find best attribute to split on, giving back its (gain, attribute, threshold, rows going left)
+    # Ties go to the attribute that comes first
+    def bestSplit(self, candidates: List[str], gains: List[Tuple]) -> Tuple:
+        best = (-1, None, None, 0)
+        for attr, (gain, threshold, leftCount) in zip(candidates, gains):
+            if gain > best[0]:
+                best = (gain, attr, threshold, leftCount)
+        return best
+
+    # Builds the same tree as train() on the full dataset, a level at a time instead of recursively, so
+    # deep trees can't run into the recursion limit. Every level reads each column front to back once:
+    # the rows' open nodes pick out each node's rows, one Counter pass per column counts the
+    # (node, class, value) of every row for all the open nodes together, and one pass over each numeric
+    # attribute's presorted rows hands every node its rows in sorted order. The data is read as many
+    # times as the tree is deep instead of once per node
+    def trainLevelwise(self) -> Node:
+        rowCount = len(self.targetCodes)
+        presorted = self.presortAll()
+        discrete = [attr for attr in self.attributes if attr not in self.numericAttributes]
+        # count keys pack (node, class code + 1, value code + 1) into one int, like countTables does
+        classSpan = len(self.targetDictionary) + 1
+        stride = max((len(self.data.dictionaries[attr]) for attr in discrete), default=0) + 1
+        targetKeys = [code + 1 for code in self.targetCodes]
+        # the open node each row has reached, as its place in frontier (-1 once the row is in a leaf)
+        nodeOf = [0] * rowCount
+        root = Node()
+        # the nodes of this level still to be built, with the attributes each can split on
+        frontier = [(root, self.attributes)]
+        depth = 0
+        while frontier:
+            # class counts of every open node, rows in leaves give negative keys
+            classKeys = list(map(add, map(classSpan.__mul__, nodeOf), targetKeys))
+            classCounts = [{} for _ in frontier]
+            for key, count in Counter(classKeys).items():
+                if key >= 0:
+                    index, targetKey = divmod(key, classSpan)
+                    classCounts[index][targetKey - 1] = count
+
+            # Same pruning conditions as buildTree, and nodes with one class become leaves
+            candidates = [None] * len(frontier)
+            for index, (node, availableAttributes) in enumerate(frontier):
+                counts = classCounts[index]
+                if (depth >= self.maxDepth or sum(counts.values()) < self.minSamples or not availableAttributes
+                        or len(counts) == 1):
+                    self.makeLeaf(node, self.majorityFromCounts(counts))
+                else:
+                    candidates[index] = self.candidateAttributes(availableAttributes)
+            wanted = {attr for attributes in candidates if attributes for attr in attributes}
+
+            # the count tables of every open node, one pass per discrete column
+            tables = [{} for _ in frontier]
+            scaledKeys = [key * stride + 1 for key in classKeys]
+            for attr in discrete:
+                if attr not in wanted:
+                    continue
+                for key, count in Counter(map(add, scaledKeys, self.columns[attr])).items():
+                    if key < 0:
+                        continue
+                    classKey, code = divmod(key, stride)
+                    index, targetKey = divmod(classKey, classSpan)
+                    tables[index].setdefault(attr, {}).setdefault(code - 1, {})[targetKey - 1] = count
+            # every open node's rows sorted by each numeric attribute, one pass per presorted order
+            # (the list on the end collects the rows in leaves)
+            sortedRows = [{} for _ in frontier]
+            for attr, order in presorted.items():
+                if attr not in wanted:
+                    continue
+                buckets = [[] for _ in range(len(frontier) + 1)]
+                deque(map(list.append, map(buckets.__getitem__, map(nodeOf.__getitem__, order)), order), maxlen=0)
+                for index, rows in enumerate(buckets[:-1]):
+                    sortedRows[index][attr] = rows
+            # every open node's rows in row order
+            groups = [[] for _ in range(len(frontier) + 1)]
+            deque(map(list.append, map(groups.__getitem__, nodeOf), range(rowCount)), maxlen=0)
+
+            nextFrontier = []
+            nextNodeOf = [-1] * rowCount
+            for index, (node, availableAttributes) in enumerate(frontier):
+                if candidates[index] is None:
+                    continue
+                counts = classCounts[index]
+                gains = []
+                for attr in candidates[index]:
+                    if attr in self.numericAttributes:
+                        gains.append(self.thresholdGain(sortedRows[index][attr], attr))
+                    else:
+                        gains.append((self.gainFromCounts(counts, tables[index].get(attr, {})), None, 0))
+                bestGain, bestAttribute, bestThreshold, bestLeftCount = self.bestSplit(candidates[index], gains)
+                # if no info gain make this a leaf node
+                if bestGain <= 0:
+                    self.makeLeaf(node, self.majorityFromCounts(counts))
+                    continue
+                node.attribute = bestAttribute
+                node.default = self.majorityFromCounts(counts)
+                node.samples = sum(counts.values())
+
+                # A numeric attribute splits in two, the rows go the way thresholdPartition sends them
+                if bestThreshold is not None:
+                    node.threshold = bestThreshold
+                    rows = sortedRows[index][bestAttribute]
+                    known = len(rows) - sum(map(self.missing[bestAttribute].__getitem__, rows))
+                    missingSide = 0 if bestLeftCount >= known - bestLeftCount else 1
+                    sides = []
+                    for key in ('<=', '>'):
+                        node.children[key] = Node()
+                        sides.append(len(nextFrontier))
+                        nextFrontier.append((node.children[key], availableAttributes))
+                    for part, side in ((rows[:bestLeftCount], sides[0]), (rows[bestLeftCount:known], sides[1]),
+                                       (rows[known:], sides[missingSide])):
+                        deque(map(nextNodeOf.__setitem__, part, repeat(side)), maxlen=0)
+                    continue
+
+                # Create child nodes for each value of the best attribute that some rows have
+                dictionary = self.data.dictionaries[bestAttribute]
+                table = tables[index][bestAttribute]
+                remainingAttributes = [attr for attr in availableAttributes if attr != bestAttribute]
+                # where the rows of each code go next, rows with other codes (or missing ones) are done
+                route = [-1] * (len(dictionary) + 1)
+                for value in self.data.discreteValues[bestAttribute]:
+                    code = dictionary.lookup(value)
+                    if code not in table:
+                        node.children[value] = Node(isLeaf=True, value=self.majorityFromCounts(counts))
+                        continue
+                    node.children[value] = Node()
+                    route[code] = len(nextFrontier)
+                    nextFrontier.append((node.children[value], remainingAttributes))
+                rows = groups[index]
+                codes = self.columns[bestAttribute]
+                deque(map(nextNodeOf.__setitem__, rows, map(route.__getitem__, map(codes.__getitem__, rows))),
+                      maxlen=0)
+
+            frontier = nextFrontier
+            nodeOf = nextNodeOf
+            depth += 1
+        return root
+
+    # Turns an open node of trainLevelwise into a leaf
+    def makeLeaf(self, node: Node, value: str) -> None:
+        node.isLeaf = True
+        node.value = node.default = value
+
+    # train the decision tree on the full dataset, or on the row numbers in rows (which can repeat, as in
+    # a bootstrap sample)
+    # Every node works on a range of one shared order of the rows, which the splits sort in place
+    # workers > 1 builds the tree in that many processes (see parallelBuild), the tree comes out the same
+    def train(self, workers: int = 1, subtreeRows: Optional[int] = None, rows: Optional[List[int]] = None) -> Node:
+        rowCount = len(self.targetCodes)
+        presorted = self.presortAll()
+        if rows is None:
+            self.order = array('i', range(rowCount))
+            self.sortedOrders = {attr: array('i', order) for attr, order in presorted.items()}
+        else:
+            self.order = array('i', rows)
+            # the sorted orders of a sample come from the full ones, each row repeated as often as it was drawn
+            times = [0] * rowCount
+            for row in rows:
+                times[row] += 1
+            self.sortedOrders = {attr: array('i', chain.from_iterable(map(repeat, order, map(times.__getitem__, order))))
+                                 for attr, order in presorted.items()}
+        # which side of a threshold each row goes (only the rows of the node being split are looked at)
+        self.side = bytearray(rowCount)
+        if workers > 1:
+            return self.parallelBuild(workers, subtreeRows)
+        return self.buildTree(0, len(self.order), self.attributes)
+
+    # Every row sorted by each numeric attribute, worked out the first time it is needed and kept for
+    # every tree trained after that, partition keeps every node's range of these orders sorted
+    def presortAll(self) -> Dict[str, array]:
+        if getattr(self, '_presorted', None) is None:
+            rows = range(len(self.targetCodes))
+            self._presorted = {attr: self.presort(attr, rows)
+                               for attr in self.attributes if attr in self.numericAttributes}
+        return self._presorted
+
+    # Rows sorted by a numeric attribute, the rows with a missing value go on the end
+    def presort(self, attribute: str, rows) -> array:
+        missing = self.missing[attribute]
+        known = [row for row in rows if not missing[row]]
+        known.sort(key=self.columns[attribute].__getitem__)
+        return array('i', known + [row for row in rows if missing[row]])
+
+    # Builds the tree with a pool of worker processes that each get a copy of this model once, when they
+    # start (with fork they share the parent's memory). Nodes with more than subtreeRows rows are split
+    # here with the count tables of their attributes worked out in the workers, smaller nodes are sent to
+    # a worker as a whole subtree. Either way only row numbers go to the workers, never the Data
+    def parallelBuild(self, workers: int, subtreeRows: Optional[int] = None) -> Node:
+        if subtreeRows is None:
+            # a few subtrees per worker keeps them all busy
+            subtreeRows = max(self.minSamples, len(self.order) // (workers * 4))
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork') if 'fork' in methods else None
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=_initWorker, initargs=(self,)) as pool:
+
+            def buildChild(start: int, end: int, availableAttributes: List[str], depth: int):
+                dataIndices = memoryview(self.order)[start:end]
+                # Same pruning conditions as buildTree
+                if depth >= self.maxDepth or len(dataIndices) < self.minSamples or not availableAttributes:
+                    return Node(isLeaf=True, value=self.majorityValue(dataIndices))
+                rows = self.order[start:end]
+                sortedRows = {attr: order[start:end] for attr, order in self.sortedOrders.items()}
+                if len(rows) <= subtreeRows:
+                    return pool.submit(_buildSubtree, rows, sortedRows, availableAttributes, depth)
+                # the gains of each slice of the attributes are worked out in their own worker
+                candidates = self.candidateAttributes(availableAttributes)
+                step = -(-len(candidates) // workers)
+                slices = [candidates[i:i + step] for i in range(0, len(candidates), step)]
+                futures = [pool.submit(_nodeGains, rows, {attr: sortedRows[attr] for attr in attributes
+                                                          if attr in sortedRows}, attributes)
+                           for attributes in slices]
+                gains = []
+                for future in futures:
+                    classCounts, sliceGains = future.result()
+                    gains.extend(sliceGains)
+                # If all examples have same class, return leaf node
+                if len(classCounts) == 1:
+                    return Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
+                return self.split(start, end, availableAttributes, depth, classCounts, gains, buildChild,
+                                  candidates)
+
+            return _collectSubtrees(buildChild(0, len(self.order), self.attributes, 0))
+
+    # The tree training with a smaller maxDepth and a larger minSamples would have grown, cut out of a tree
+    # trained with looser ones. Where the split is made doesn't depend on either setting, so the smaller
+    # tree is the bigger one with every split at depth >= maxDepth or with fewer than minSamples rows
+    # turned into a leaf of its majority class
+    def truncate(self, tree: Node, maxDepth: int, minSamples: int, depth: int = 0) -> Node:
+        if tree.isLeaf:
+            return tree
+        if depth >= maxDepth or tree.samples < minSamples:
+            return Node(isLeaf=True, value=tree.default)
+        node = Node(attribute=tree.attribute, default=tree.default, threshold=tree.threshold, samples=tree.samples)
+        for value, child in tree.children.items():
+            node.children[value] = self.truncate(child, maxDepth, minSamples, depth + 1)
+        return node
+
+    # Accuracy (as a percentage) on testData of the tree every (maxDepth, minSamples) in grid gives
+    # The tree is trained once, with the largest maxDepth and smallest minSamples of the grid, and every
+    # setting's tree is truncated out of it
+    def sweep(self, grid: List[Tuple[int, int]], testData) -> Dict[Tuple[int, int], float]:
+        grid = list(grid)
+        settings = (self.maxDepth, self.minSamples)
+        self.maxDepth = max(maxDepth for maxDepth, _ in grid)
+        self.minSamples = min(minSamples for _, minSamples in grid)
+        try:
+            tree = self.train()
+        finally:
+            self.maxDepth, self.minSamples = settings
+        actual = list(testData.featureData[self.targetAttribute])
+        results = {}
+        for maxDepth, minSamples in grid:
+            predictions = self.predictBatch(self.truncate(tree, maxDepth, minSamples), testData)
+            results[(maxDepth, minSamples)] = sum(map(eq, predictions, actual)) / len(actual) * 100
+        return results
 
     # Predicts class for a single instance
     def predict(self, tree: Node, instance: Dict[str, str]) -> str:
-        if tree.isLeaf:
-            return tree.value
-        # Gets the value of the spitting attribute for this instance
-        value = instance[tree.attribute]
-        # If we haven't seen this value from training return majority class
-        if value not in tree.children:
-            return self.majorityValue(list(range(len(self.data.featureData[self.targetAttribute]))))
-        return self.predict(tree.children[value], instance)
+        while not tree.isLeaf:
+            # Gets the value of the spitting attribute for this instance
+            value = instance[tree.attribute]
+            # numeric splits pick a side of the threshold, missing values get the node's majority class
+            if tree.threshold is not None:
+                if value is None:
+                    return tree.default
+                tree = tree.children['<=' if value <= tree.threshold else '>']
+                continue
+            # If we haven't seen this value at this node return the node's majority class
+            if value not in tree.children:
+                return tree.default
+            tree = tree.children[value]
+        return tree.value
+
+    # Flattens a trained tree into a CompiledTree for batch predictions
+    def compile(self, tree: Node) -> CompiledTree:
+        return CompiledTree(tree, self.data.dictionaries, self.targetDictionary)
+
+    # Predicts the class of every row of a Data at once (compiling the tree the first time it is seen)
+    def predictBatch(self, tree: Node, testData) -> List[str]:
+        compiled = getattr(self, '_compiled', None)
+        if compiled is None or compiled[0] is not tree:
+            compiled = self._compiled = (tree, self.compile(tree))
+        return compiled[1].predictBatch(testData)
 
     # Print the decision tree structure
     def printTree(self, node: Node, indent: str = "") -> None:
@@ -136,5 +765,95 @@ class ID3:
             return
         print(f"{indent}Split on {node.attribute}")
         for value, child in node.children.items():
-            print(f"{indent}If {node.attribute} = {value}:")
-            self.printTree(child, indent + " ")
\ No newline at end of file
+            if node.threshold is not None:
+                print(f"{indent}If {node.attribute} {value} {node.threshold:g}:")
+            else:
+                print(f"{indent}If {node.attribute} = {value}:")
+            self.printTree(child, indent + " ")
+
+# Bitset with bit i set when byte i of rowBytes is byte. The rows are taken every 8th one at a time and
+# bytes.translate turns each of them into the bit it goes in, so nothing loops over the rows in Python
+def packBits(rowBytes: bytes, byte: int = 1) -> int:
+    packed = 0
+    for bit in range(8):
+        table = bytearray(256)
+        table[byte] = 1 << bit
+        packed |= int.from_bytes(rowBytes[bit::8].translate(table), 'little')
+    return packed
+
+
+# One bitset per code found in a code column (missing values get code -1)
+def codeBitsets(codes) -> Dict[int, int]:
+    present = sorted(set(codes))
+    if present and present[-1] < 255:
+        # one byte per row, with -1 becoming 255
+        rowBytes = bytes(map(and_, codes, repeat(255)))
+        return {code: packBits(rowBytes, code & 255) for code in present}
+    return {code: packBits(bytes(map(code.__eq__, codes))) for code in present}
+
+
+# ID3 where every set of rows is an int used as a bitset, for discrete data with lots of rows.
+# Each (attribute, value) and each class gets its bitset once, a node's rows are a bitset, its
+# children are ANDs of it with the bitsets of their values and every count is a popcount, so counting
+# works on 64 rows at a time instead of one.
+# Grows the same tree as ID3, except that ties between equally common classes go to the class declared
+# first instead of the class seen first
+class BitsetID3(ID3):
+    def __init__(self, data, targetAttribute: str, maxDepth=10, minSamples=5):
+        super().__init__(data, targetAttribute, maxDepth, minSamples)
+        if self.numericAttributes:
+            raise ValueError(f"Numerical attribute '{min(self.numericAttributes)}' found. BitsetID3 only supports "
+                             f"discrete attributes (use ID3, or bin them first with discretizer.Discretizer).")
+        self.classBits = codeBitsets(self.targetCodes)
+        self.valueBits = {attr: codeBitsets(self.columns[attr]) for attr in self.attributes}
+
+    # train the decision tree on the full dataset
+    def train(self) -> Node:
+        return self.buildBits((1 << len(self.targetCodes)) - 1, self.attributes)
+
+    # Recursive algorithm to build decision tree on the rows set in the bitset rows
+    def buildBits(self, rows: int, availableAttributes: List[str], depth=0) -> Node:
+        # the rows of each class, and how many there are
+        classRows = {code: rows & bits for code, bits in self.classBits.items()}
+        classCounts = {code: bits.bit_count() for code, bits in classRows.items() if bits}
+        # Check pruning conditions
+        if depth >= self.maxDepth or sum(classCounts.values()) < self.minSamples or not availableAttributes:
+            return Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
+        # If all examples have same class, return leaf node
+        if len(classCounts) == 1:
+            return Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
+
+        # the count table of an attribute has the popcount of (value bits AND class rows) for each pair
+        bestGain = -1
+        bestAttribute = None
+        for attr in availableAttributes:
+            table = {}
+            for code, valueBits in self.valueBits[attr].items():
+                valueCounts = {}
+                for targetCode, bits in classRows.items():
+                    count = (bits & valueBits).bit_count()
+                    if count:
+                        valueCounts[targetCode] = count
+                if valueCounts:
+                    table[code] = valueCounts
+            gain = self.gainFromCounts(classCounts, table)
+            if gain > bestGain:
+                bestGain = gain
+                bestAttribute = attr
+        # if no info gain make this a leaf node
+        if bestGain <= 0:
+            return Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
+
+        node = Node(attribute=bestAttribute, default=self.majorityFromCounts(classCounts),
+                    samples=sum(classCounts.values()))
+        dictionary = self.data.dictionaries[bestAttribute]
+        valueBits = self.valueBits[bestAttribute]
+        remainingAttributes = [attr for attr in availableAttributes if attr != bestAttribute]
+        for value in self.data.discreteValues[bestAttribute]:
+            childRows = rows & valueBits.get(dictionary.lookup(value), 0)
+            # if no examples in this value create leaf with majority class
+            if not childRows:
+                node.children[value] = Node(isLeaf=True, value=self.majorityFromCounts(classCounts))
+            else:
+                node.children[value] = self.buildBits(childRows, remainingAttributes, depth + 1)
+        return node
@@ -4,22 +4,415 @@ Implements the K-Nearest Neighbors Algorithm
 
 Can handle both numeric and categorical features
 """
+import heapq
 import math
+import multiprocessing
+import random
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from typing import Dict, List, Set, Any
 from collections import Counter
+from itertools import chain, repeat
+from operator import add, mul, ne
+
+#numpy is optional, predictBatch uses it when it is installed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#How much memory the distance matrix of one chunk of queries in predictBatch may take
+BATCH_BYTES = 1 << 26
+#How many chunks of test rows predictBatch gives each worker process
+CHUNKS_PER_WORKER = 4
+BACKENDS = ('numpy', 'python')
+#A squared distance this much past the square of a distance has a square root past it even after rounding
+ROUNDING_MARGIN = 1 + 2 ** -50
+#How much a row in a bucket LSHIndex probes next to the query's own counts towards being a candidate
+PROBE_WEIGHT = 0.5
+
+def _keepNearest(best, k, squared, row):
+    """
+    Keeps a row in best, the bounded max-heap of the k nearest rows found so far
+    The rows are kept as (-distance, -row) so the farthest one (and of those the last) is on top,
+    which sends ties to the row that comes first like sorting every distance would
+    """
+    item = (-math.sqrt(squared), -row)
+    if len(best) < k:
+        heapq.heappush(best, item)
+    elif item > best[0]:
+        heapq.heapreplace(best, item)
+
+def _abandonLimit(best, k):
+    """
+    :return: the squared distance past which a row can't get into best anymore
+    """
+    if len(best) < k:
+        return math.inf
+    farthest = best[0][0]
+    return farthest * farthest * ROUNDING_MARGIN
+
+def _nearestRows(best):
+    """
+    :return: the rows in best, nearest first
+    """
+    best.sort(reverse=True)
+    return [-row for _, row in best]
+
+#The training rows every worker process of KNN.predictBatch finds neighbors among, attached from shared memory
+_workerState = None
+
+def _initWorker(names, rowCount, numericCount, codeCount, features, k, backend):
+    """
+    Attaches a worker process to the packed training rows KNN.predictBatch put in shared memory
+    """
+    global _workerState
+    numericBlock, codeBlock = (shared_memory.SharedMemory(name=name) for name in names)
+    numeric = numericBlock.buf[:rowCount * numericCount * array('d').itemsize].cast('d')
+    codes = codeBlock.buf[:rowCount * codeCount * array('i').itemsize].cast('i')
+    if backend == 'numpy':
+        numeric = np.frombuffer(numeric, dtype=np.float64).reshape(rowCount, numericCount)
+        codes = np.frombuffer(codes, dtype=np.intc).reshape(rowCount, codeCount)
+    #the python engine works down columns, which are every numericCount-th value of the packed rows
+    else:
+        numeric = [numeric[j::numericCount] for j in range(numericCount)]
+        codes = [codes[j::codeCount] for j in range(codeCount)]
+    #the blocks are kept so their memory stays mapped
+    _workerState = (numericBlock, codeBlock, numeric, codes, rowCount, features, k, backend)
+
+def _chunkNeighbors(chunk):
+    """
+    Finds the neighbors of one chunk of queries in a worker process
+    :return: the indices of each query's neighbors, nearest first
+    """
+    _, _, numeric, codes, rowCount, features, k, backend = _workerState
+    queryNumeric, queryCodes, queryCount = chunk
+    if backend == 'numpy':
+        return _numpyNeighbors(numeric, codes, queryNumeric, queryCodes, k, features)
+    return _pythonNeighbors(numeric, codes, queryNumeric, queryCodes, k, rowCount, queryCount, features)
+
+class PackedRows:
+    def __init__(self, numericMatrix, codeMatrix, features):
+        """
+        Training rows packed one after another, as KNN keeps them
+
+        :param numericMatrix: normalized numeric features packed row after row (nan where there is no value)
+        :param codeMatrix: categorical codes packed row after row
+        :param features: for every feature in distance order, whether it is numeric and its column
+        """
+        self.numericMatrix = numericMatrix
+        self.codeMatrix = codeMatrix
+        self.features = features
+        self.numericCount = sum(1 for isNumeric, _ in features if isNumeric)
+        self.codeCount = len(features) - self.numericCount
+
+    def squaredDistance(self, row, queryNumeric, queryCodes, limit=math.inf):
+        """
+        Same squared distance as KNN._squaredDistance between a training row and a query, which stops
+        adding up as soon as it is past limit
+        """
+        numericBase = row * self.numericCount
+        codeBase = row * self.codeCount
+        distance = 0.0
+        for isNumeric, j in self.features:
+            if isNumeric:
+                value = queryNumeric[j]
+                other = self.numericMatrix[numericBase + j]
+                if value == value and other == other:
+                    distance += (value - other)**2
+                #Missing values add the maxium possible distance
+                else:
+                    distance += 1.0
+            else:
+                code = queryCodes[j]
+                other = self.codeMatrix[codeBase + j]
+                if code != other or code < 0 or other < 0:
+                    distance += 1.0
+            if distance > limit:
+                break
+        return distance
+
+class KDTree(PackedRows):
+    def __init__(self, numericMatrix, codeMatrix, features, rowCount, leafSize=16):
+        """
+        Exact k-nearest neighbor index over the training rows. Each node splits its rows in two at the
+        median of the numeric feature that is most spread out among them (or, once none is, of the categorical
+        feature with the most codes) and keeps the box around its numeric values and which codes each
+        categorical feature has in it, so a query can tell how close any row of the node can possibly be
+
+        :param numericMatrix: normalized numeric features packed row after row (nan where there is no value)
+        :param codeMatrix: categorical codes packed row after row
+        :param features: for every feature in distance order, whether it is numeric and its column
+        :param rowCount: number of training rows
+        :param leafSize: most rows a leaf holds (default: 16)
+        """
+        super().__init__(numericMatrix, codeMatrix, features)
+        self.leafSize = leafSize
+
+        #per node: lowest and highest numeric values, whether a numeric column has missing values in it,
+        #a bitmask of the codes (shifted by one) each categorical column has, its two children and a leaf's rows
+        self.lows = []
+        self.highs = []
+        self.missing = []
+        self.masks = []
+        self.children = []
+        self.leaves = []
+        if rowCount:
+            self._build(list(range(rowCount)))
+
+    def _build(self, rows):
+        """
+        Adds the node holding rows (and everything below it)
+        :return: the node's number
+        """
+        node = len(self.lows)
+        numericMatrix, numericCount = self.numericMatrix, self.numericCount
+        codeMatrix, codeCount = self.codeMatrix, self.codeCount
+        lows, highs, missing = [], [], []
+        spreads = []
+        for j in range(numericCount):
+            values = [numericMatrix[row * numericCount + j] for row in rows]
+            known = [value for value in values if value == value]
+            lows.append(min(known, default=math.inf))
+            highs.append(max(known, default=-math.inf))
+            missing.append(len(known) < len(values))
+            spreads.append(highs[-1] - lows[-1] if known else 0.0)
+        masks = []
+        for j in range(codeCount):
+            mask = 0
+            for code in set(codeMatrix[row * codeCount + j] for row in rows):
+                mask |= 1 << (code + 1)
+            masks.append(mask)
+        self.lows.append(tuple(lows))
+        self.highs.append(tuple(highs))
+        self.missing.append(tuple(missing))
+        self.masks.append(tuple(masks))
+        self.children.append(None)
+        self.leaves.append(None)
+
+        #split on the widest numeric feature, or the categorical one with the most codes
+        key = None
+        if spreads and max(spreads) > 0:
+            j = spreads.index(max(spreads))
+            value = lambda row: numericMatrix[row * numericCount + j]
+            key = lambda row: (value(row) != value(row), value(row))
+        elif masks and max(bin(mask).count('1') for mask in masks) > 1:
+            j = max(range(codeCount), key=lambda j: bin(masks[j]).count('1'))
+            key = lambda row: codeMatrix[row * codeCount + j]
+        if len(rows) <= self.leafSize or key is None:
+            self.leaves[node] = rows
+            return node
+
+        rows.sort(key=key)
+        middle = len(rows) // 2
+        left = self._build(rows[:middle])
+        right = self._build(rows[middle:])
+        self.children[node] = (left, right)
+        return node
+
+    def lowerBound(self, node, queryNumeric, queryCodes):
+        """
+        Smallest squared distance any row of the node can have from the query: the distance to the node's box
+        plus one for every categorical feature none of its rows matches. The terms are added in the same order
+        as calculateDistance adds them, so the bound never rounds above a row's actual distance
+        """
+        lows, highs, missing, masks = self.lows[node], self.highs[node], self.missing[node], self.masks[node]
+        bound = 0.0
+        for isNumeric, j in self.features:
+            if isNumeric:
+                value = queryNumeric[j]
+                #Missing values add the maxium possible distance
+                if value != value:
+                    bound += 1.0
+                    continue
+                if value < lows[j]:
+                    difference = value - lows[j]
+                elif value > highs[j]:
+                    difference = value - highs[j]
+                else:
+                    continue
+                squared = difference * difference
+                #a row missing the value only adds 1
+                if missing[j] and squared > 1.0:
+                    squared = 1.0
+                bound += squared
+            else:
+                code = queryCodes[j]
+                if code < 0 or not masks[j] >> (code + 1) & 1:
+                    bound += 1.0
+        return bound
+
+    def query(self, queryNumeric, queryCodes, k):
+        """
+        Finds the k nearest training rows of a query, ties go to the row that comes first like in KNN.predict
+        :param queryNumeric: the query's normalized numeric features (nan where there is no value)
+        :param queryCodes: the query's categorical codes
+        :return: the indices of the query's neighbors, nearest first
+        """
+        if k <= 0 or not self.lows:
+            return []
+        best = []
+        self._search(0, self.lowerBound(0, queryNumeric, queryCodes), queryNumeric, queryCodes, k, best)
+        return _nearestRows(best)
+
+    def _search(self, node, bound, queryNumeric, queryCodes, k, best):
+        """
+        Adds the rows under node that are nearer than the farthest neighbor found so far to best,
+        skipping the nodes whose lower bound is already farther
+        """
+        #a node as far as the farthest neighbor can still hold a row that comes before it
+        limit = _abandonLimit(best, k)
+        if bound > limit:
+            return
+        children = self.children[node]
+        if children is None:
+            for row in self.leaves[node]:
+                squared = self.squaredDistance(row, queryNumeric, queryCodes, limit)
+                if squared <= limit:
+                    _keepNearest(best, k, squared, row)
+                    limit = _abandonLimit(best, k)
+            return
+        #the child that could be nearer first
+        bounds = [(self.lowerBound(child, queryNumeric, queryCodes), child) for child in children]
+        bounds.sort()
+        for childBound, child in bounds:
+            self._search(child, childBound, queryNumeric, queryCodes, k, best)
+
+class LSHIndex(PackedRows):
+    def __init__(self, numericMatrix, codeMatrix, features, rowCount, tables=8, projections=4, width=0.5,
+                 minHashes=1, probes=1, candidates=200, seed=None):
+        """
+        Approximate nearest neighbor index: every table puts each training row in a bucket, keyed by random
+        projections of its normalized numeric features (cut into pieces width long) and the MinHash of its
+        categorical values, so rows that are close tend to share buckets. A query looks in its own bucket of
+        every table (and the probes buckets next to it that it is closest to) and only the rows found there
+        are ranked by their actual distance
+
+        :param tables: number of hash tables, more find more of the true neighbors but take longer
+        :param projections: random projections of the numeric features in each bucket key
+        :param width: width of a projection's pieces, in normalized units
+        :param minHashes: MinHash values of the categorical features in each bucket key
+        :param probes: extra buckets next to the query's own looked at in each table
+        :param candidates: most rows ranked per query
+        :param seed: seed for the random projections and hashes
+        """
+        super().__init__(numericMatrix, codeMatrix, features)
+        self.width = width
+        self.probes = probes
+        self.candidates = candidates
+        rng = random.Random(seed)
+        numericCount, codeCount = self.numericCount, self.codeCount
+        #the largest code of each categorical feature, codes past it were never seen in training
+        self.codeSizes = [max(codeMatrix[j::codeCount], default=-1) + 1 for j in range(codeCount)]
+
+        #per table: a normal direction and offset per projection, a random rank of every (feature, code) per MinHash
+        self.directions = [[[rng.gauss(0, 1) for _ in range(numericCount)] for _ in range(projections)]
+                           for _ in range(tables)] if numericCount else [[] for _ in range(tables)]
+        self.offsets = [[rng.uniform(0, width) for _ in range(projections)] for _ in range(tables)]
+        self.ranks = [[[[rng.random() for _ in range(size)] for size in self.codeSizes] for _ in range(minHashes)]
+                      for _ in range(tables)] if codeCount else [[] for _ in range(tables)]
+
+        #per table: bucket key -> training rows in it
+        self.buckets = [{} for _ in range(tables)]
+        for row in range(rowCount):
+            numeric = numericMatrix[row * numericCount:(row + 1) * numericCount]
+            codes = codeMatrix[row * codeCount:(row + 1) * codeCount]
+            for table, buckets in enumerate(self.buckets):
+                positions = self._positions(table, numeric)
+                key = tuple(math.floor(position) for position in positions) + self._minHashes(table, codes)
+                buckets.setdefault(key, []).append(row)
+
+    def _positions(self, table, numeric):
+        """
+        :return: where the row falls along each of the table's projections, in widths
+        """
+        #a missing value hashes like the middle of the range, where KNN puts missing training values
+        numeric = [0.5 if value != value else value for value in numeric]
+        return [(sum(map(mul, direction, numeric)) + offset) / self.width
+                for direction, offset in zip(self.directions[table], self.offsets[table])]
+
+    def _minHashes(self, table, codes):
+        """
+        :return: for each of the table's MinHashes, the (feature, code) of the row's with the lowest rank
+        (missing and never seen codes match nothing, so they are left out)
+        """
+        hashes = []
+        for ranks in self.ranks[table]:
+            known = [(ranks[j][code], j, code) for j, code in enumerate(codes) if 0 <= code < self.codeSizes[j]]
+            hashes.append(min(known)[1:] if known else None)
+        return tuple(hashes)
+
+    def _candidates(self, queryNumeric, queryCodes):
+        """
+        :return: the training rows in the query's buckets, at most self.candidates of them
+        """
+        ownKeys = []
+        probeKeys = []
+        for table in range(len(self.buckets)):
+            positions = self._positions(table, queryNumeric)
+            pieces = [math.floor(position) for position in positions]
+            minHashes = self._minHashes(table, queryCodes)
+            ownKeys.append((table, tuple(pieces) + minHashes))
+            #the buckets over the piece boundaries the query is closest to
+            steps = [(position - piece, i, -1) for i, (position, piece) in enumerate(zip(positions, pieces))]
+            steps += [(piece + 1 - position, i, 1) for i, (position, piece) in enumerate(zip(positions, pieces))]
+            steps.sort()
+            for _, i, step in steps[:self.probes]:
+                probe = list(pieces)
+                probe[i] += step
+                probeKeys.append((table, tuple(probe) + minHashes))
+
+        #rows sharing more of the query's buckets are more likely near it, those are ranked first
+        #(a probed bucket counts for less than an own one, ties go to the row that comes first)
+        collisions = Counter()
+        for table, key in ownKeys:
+            collisions.update(self.buckets[table].get(key, ()))
+        for table, key in probeKeys:
+            for row in self.buckets[table].get(key, ()):
+                collisions[row] += PROBE_WEIGHT
+        if len(collisions) <= self.candidates:
+            return list(collisions)
+        return heapq.nsmallest(self.candidates, collisions, key=lambda row: (-collisions[row], row))
+
+    def query(self, queryNumeric, queryCodes, k):
+        """
+        Finds (about) the k nearest training rows of a query among the rows in its buckets
+        :return: the indices of the neighbors found, nearest first, fewer than k if the buckets held fewer rows
+        """
+        best = []
+        limit = _abandonLimit(best, k)
+        for row in self._candidates(queryNumeric, queryCodes):
+            squared = self.squaredDistance(row, queryNumeric, queryCodes, limit)
+            if squared <= limit:
+                _keepNearest(best, k, squared, row)
+                limit = _abandonLimit(best, k)
+        return _nearestRows(best)
 
 class KNN:
-    def __init__(self, data, targetAttribute, k=3):
+    def __init__(self, data, targetAttribute, k=3, backend=None, useIndex=True):
         """
         Initializes the KNN model
 
         :param data: contains the training data
         :param targetAttribute: what target to predict
         :param k: number of neighbors to consider (default: 3)
+        :param backend: how predictBatch computes distances, 'numpy' or 'python' (default: numpy when installed)
+        :param useIndex: whether predict searches a KDTree over dense training data instead of every row, the tree
+            is built by the first predict (default: True)
         """
         self.data = data
         self.targetAttribute = targetAttribute
         self.k = k
+        if backend is None:
+            backend = 'numpy' if np is not None else 'python'
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}', use one of {', '.join(BACKENDS)}")
+        if backend == 'numpy' and np is None:
+            raise ValueError("The numpy backend needs numpy installed")
+        self.backend = backend
+        #training blocks for predictBatch, built the first time they are needed
+        self._blocks = None
 
         #Stores the feature types for speed
         self.featureTypes = {}
@@ -28,11 +421,48 @@ class KNN:
             if attr != targetAttribute:
                 self.featureTypes[attr] = data.getFeatureType(attr)
 
+        #Stores the min, max and range of every numeric feature with stats, so normalizing a value is one lookup
+        self.numericScales = {}
+        for attr in self.featureTypes:
+            if self.featureTypes[attr] == 'numeric' and attr in data.numericStats:
+                minValue = data.numericStats[attr]['min']
+                maxValue = data.numericStats[attr]['max']
+                self.numericScales[attr] = (minValue, maxValue, maxValue - minValue)
+
+        #Sparse training data only keeps the non-default entries of each row
+        self.sparse = data.isSparse()
+        if self.sparse:
+            self.attributePosition = {attr: i for i, attr in enumerate(data.attributes)}
+            self.sparseDefaults = {attr: self._normalizeValue(attr, value)
+                                   for attr, value in data.defaults().items() if attr in self.featureTypes}
+            #per attribute position: whether it is a numeric feature and its normalized default
+            self.positionNumeric = [self.featureTypes.get(attr) == 'numeric' for attr in data.attributes]
+            self.positionDefaults = [self.sparseDefaults.get(attr) for attr in data.attributes]
+            #ends every list of positions, past any attribute's
+            self.endPosition = len(data.attributes)
+            self.normalizedRows = self._normalizeSparseRows()
         #Normalize numeric features for training data
-        self.normalizedData = self._normalizeData()
+        else:
+            self.normalizedData = self._normalizeData()
 
         #Store the indices of the features to use (all except target)
         self.featureIndices = [attr for attr in data.attributes if attr != targetAttribute]
+        self.numericAttributes = [attr for attr in self.featureIndices if self.featureTypes[attr] == 'numeric']
+        self.categoricalAttributes = [attr for attr in self.featureIndices if self.featureTypes[attr] != 'numeric']
+        self.features = self._featureColumns()
+
+        #KDTree over the packed rows, built by the first predict that needs it (predictBatch doesn't)
+        self.useIndex = useIndex
+        self.index = None
+        #set up by approximate()
+        self.approximateIndex = None
+
+        #Pack the normalized training rows one after another, row i's numeric features start at
+        #i * len(numericAttributes) in numericMatrix and its codes at i * len(categoricalAttributes) in codeMatrix
+        if not self.sparse:
+            numeric, codes = self._columnBlocks(self.normalizedData)
+            self.numericMatrix = array('d', chain.from_iterable(zip(*numeric)))
+            self.codeMatrix = array('i', chain.from_iterable(zip(*codes)))
 
     def _normalizeData(self):
         """
@@ -44,55 +474,94 @@ class KNN:
         for attr in self.featureTypes:
             if self.featureTypes[attr] == 'numeric':
                 #check to see if we have min/max numbers
-                if attr in self.data.numericStats:
-                    minValue = self.data.numericStats[attr]['min']
-                    maxValue = self.data.numericStats[attr]['max']
-                    rangeValue = maxValue - minValue
+                if attr in self.numericScales:
+                    minValue, maxValue, rangeValue = self.numericScales[attr]
 
                     #Avoid dividing by zero
                     if rangeValue == 0:
-                        normalized[attr] = [0.5 for _ in self.data.featureData[attr]]
+                        normalized[attr] = array('d', [0.5]) * len(self.data.featureData[attr])
                     else:
-                        normalized[attr] = [(x - minValue) / rangeValue if x is not None else 0.5
-                                            for x in self.data.featureData[attr]]
+                        normalized[attr] = array('d', ((x - minValue) / rangeValue if x is not None else 0.5
+                                                       for x in self.data.featureData[attr]))
                 #if no stats available use raw values
                 else:
                     normalized[attr] = self.data.featureData[attr]
 
-            #for categorical features don't normalize
+            #for categorical features don't normalize, just compare their integer codes
             else:
-                normalized[attr] = self.data.featureData[attr]
+                normalized[attr] = self.data.featureData[attr].codes
 
         return normalized
 
+    def _normalizeSparseRows(self):
+        """
+        Normalizes only the stored (non-default) entries of each sparse training row
+        SparseRows keeps every row's entries in attribute order, so the positions come out sorted
+        :return: a list with one (feature positions followed by endPosition, normalized values) pair per training row
+        """
+        names = self.data.attributeNames
+        rows = []
+
+        for i in range(self.data.rowCount()):
+            positions = array('i')
+            values = []
+            for index, value in self.data.sparseRows.row(i):
+                attr = names[index]
+                if attr in self.featureTypes:
+                    positions.append(index)
+                    if self.featureTypes[attr] == 'numeric':
+                        values.append(self._normalizeValue(attr, None if math.isnan(value) else value))
+                    #categorical entries are already stored as codes
+                    else:
+                        values.append(int(value))
+            positions.append(self.endPosition)
+            rows.append((positions, values))
+
+        return rows
+
+    def _sparseEntries(self, instance):
+        """
+        Turns a normalized sparse instance into the (positions, values) form training rows are kept in
+        """
+        positions = sorted(self.attributePosition[attr] for attr in instance)
+        names = self.data.attributeNames
+        values = [instance[names[position]] for position in positions]
+        positions.append(self.endPosition)
+        return positions, values
+
+    def _normalizeValue(self, attr, value):
+        """
+        Normalizes a single feature value using the training data normalization
+        """
+        if self.featureTypes[attr] == 'numeric':
+            scale = self.numericScales.get(attr)
+            if scale is not None:
+                minValue, maxValue, rangeValue = scale
+                if rangeValue == 0 or value is None:
+                    return 0.5
+                #clip values outside the training range
+                value = max(minValue, min(maxValue, value))
+                return (value - minValue) / rangeValue
+            return value
+
+        #categorical values are turned into the training codes (-1 missing, -2 never seen)
+        return self.data.dictionaries[attr].lookup(value)
+
     def normalizeInstance(self, instance):
         """
         Normalizes a single instance using the training data normalization
+        With sparse training data only the values the instance actually stores are normalized
         """
         normalizedInstance = {}
 
-        for attr in self.featureTypes:
-            if attr in instance:
-                if self.featureTypes[attr] == 'numeric':
-                    if attr in self.data.numericStats:
-                        minValue = self.data.numericStats[attr]['min']
-                        maxValue = self.data.numericStats[attr]['max']
-                        rangeValue = maxValue - minValue
-
-                        if rangeValue == 0:
-                            normalizedInstance[attr] = 0.5
-                        else:
-                            value = instance[attr]
-                            if value is None:
-                                normalizedInstance[attr] = 0.5
-                            #clip values outside the training range
-                            else:
-                                value = max(minValue, min(maxValue, value))
-                                normalizedInstance[attr] = (value - minValue) / rangeValue
-                    else:
-                        normalizedInstance[attr] = instance[attr]
-                else:
-                    normalizedInstance[attr] = instance[attr]
+        if self.sparse:
+            attrs = [attr for attr in instance.keys() if attr in self.featureTypes]
+            attrs.sort(key=self.attributePosition.__getitem__)
+        else:
+            attrs = [attr for attr in self.featureTypes if attr in instance]
+
+        for attr in attrs:
+            normalizedInstance[attr] = self._normalizeValue(attr, instance[attr])
 
         return normalizedInstance
 
@@ -101,7 +570,18 @@ class KNN:
         calculate distance between two instances
         Numeric features: euclidean distance
         for categorical features: simple match (0 if same, 1 if different)
+        Categorical values are expected as codes, as made by normalizeInstance
+        """
+        return math.sqrt(self._squaredDistance(instance1, instance2))
+
+    def _squaredDistance(self, instance1, instance2, limit=math.inf):
+        """
+        Squared distance between two instances, which stops adding up as soon as it is past limit
+        (a row that far can't be one of the neighbors anymore)
         """
+        if self.sparse:
+            return self._sparseSquaredDistance(instance1, instance2, limit)
+
         distance = 0.0
 
         for attr in self.featureIndices:
@@ -116,11 +596,57 @@ class KNN:
                     #Missing values add the maxium possible distance
                     else:
                         distance += 1.0
-                #Simple match for categorical features
+                #Simple match for categorical features, negative codes are missing or unseen values
                 else:
-                    if instance1[attr] != instance2[attr] or instance1[attr] is None or instance2[attr] is None:
+                    if instance1[attr] != instance2[attr] or instance1[attr] < 0 or instance2[attr] < 0:
                         distance += 1.0
-        return math.sqrt(distance)
+                if distance > limit:
+                    break
+        return distance
+
+    def _sparseSquaredDistance(self, instance1, instance2, limit):
+        """
+        Same squared distance as _squaredDistance for sparse instances, only looks at the features either one
+        stores (a feature both leave out holds the same default in each and adds nothing)
+        """
+        return self._mergedSquaredDistance(self._sparseEntries(instance1), self._sparseEntries(instance2), limit)
+
+    def _mergedSquaredDistance(self, entries1, entries2, limit):
+        """
+        Squared distance between two sparse instances in (positions, values) form, stopping once past limit
+        Both lists of positions are sorted, so merging them goes through the features in attribute order
+        and the sum matches the dense distance exactly
+        """
+        positions1, values1 = entries1
+        positions2, values2 = entries2
+        numeric, defaults, end = self.positionNumeric, self.positionDefaults, self.endPosition
+        distance = 0.0
+        i = j = 0
+        while True:
+            position1 = positions1[i]
+            position2 = positions2[j]
+            if position1 == position2:
+                if position1 == end:
+                    break
+                position, val1, val2 = position1, values1[i], values2[j]
+                i += 1
+                j += 1
+            elif position1 < position2:
+                position, val1, val2 = position1, values1[i], defaults[position1]
+                i += 1
+            else:
+                position, val1, val2 = position2, defaults[position2], values2[j]
+                j += 1
+            if numeric[position]:
+                if val1 is not None and val2 is not None:
+                    distance += (val1 - val2)**2
+                else:
+                    distance += 1.0
+            elif val1 != val2 or val1 < 0 or val2 < 0:
+                distance += 1.0
+            if distance > limit:
+                break
+        return distance
 
     def predict(self, instance):
         """
@@ -128,27 +654,310 @@ class KNN:
         :param instance: Dictionary with attribute name -> value mappings
         :return: predicted class value
         """
+        #get the most common value from the k nearest neighbors
+        return self.vote(self.neighbors(instance))
+
+    def vote(self, rows):
+        """
+        :param rows: training row indices, nearest first
+        :return: the most common class among them (ties go to the class of the nearer row)
+        """
+        targets = self.data.featureData[self.targetAttribute]
+        return Counter(targets[i] for i in rows).most_common(1)[0][0]
+
+    def neighbors(self, instance, exact=False):
+        """
+        Finds the k nearest training rows of an instance
+        :param instance: Dictionary with attribute name -> value mappings
+        :param exact: whether to leave out the approximate index set up by approximate() (default: False)
+        :return: the indices of the nearest training rows, nearest first
+        """
         #normalize the instance
         normalizedInstance = self.normalizeInstance(instance)
+        targets = self.data.featureData[self.targetAttribute]
+        k = min(self.k, len(targets))
+
+        #the indexes only know instances that have every feature
+        if not self.sparse and len(normalizedInstance) == len(self.featureIndices):
+            queryNumeric = [math.nan if normalizedInstance[attr] is None else normalizedInstance[attr]
+                            for attr in self.numericAttributes]
+            queryCodes = [normalizedInstance[attr] for attr in self.categoricalAttributes]
+            if self.approximateIndex is not None and not exact:
+                nearest = self.approximateIndex.query(queryNumeric, queryCodes, k)
+                #too few rows in the query's buckets to pick from, search exactly instead
+                if len(nearest) == k:
+                    return nearest
+            if self.useIndex:
+                return self._kdTree().query(queryNumeric, queryCodes, k)
 
-        #calculate the ditances to all training instances
-        distances = []
+        #keep the k nearest training instances in a heap, a row is dropped as soon as its squared
+        #distance is past the kth nearest one's
+        if self.sparse:
+            query = self._sparseEntries(normalizedInstance)
+            best = []
+            limit = _abandonLimit(best, k)
+            for i, trainEntries in enumerate(self.normalizedRows):
+                squared = self._mergedSquaredDistance(query, trainEntries, limit)
+                if squared <= limit:
+                    _keepNearest(best, k, squared, i)
+                    limit = _abandonLimit(best, k)
+        else:
+            best = self._scanPacked(normalizedInstance, k)
+        return _nearestRows(best)
+
+    def _kdTree(self):
+        """
+        :return: the KDTree over the packed training rows, built once, the first time it is asked for
+        """
+        if self.index is None:
+            self.index = KDTree(self.numericMatrix, self.codeMatrix, self.features, self.data.rowCount())
+        return self.index
+
+    def approximate(self, tables=8, projections=4, width=0.5, minHashes=1, probes=1, candidates=200, seed=None):
+        """
+        Switches predict (and predictBatch) to approximate search with an LSHIndex over the training rows:
+        only the rows sharing a bucket with the query are ranked, so some true neighbors can be missed.
+        The settings are the LSHIndex ones, see there
+        :return: the model
+        """
+        if self.sparse:
+            raise ValueError("Approximate search needs dense training data")
+        self.approximateIndex = LSHIndex(self.numericMatrix, self.codeMatrix, self.features, self.data.rowCount(),
+                                         tables, projections, width, minHashes, probes, candidates, seed)
+        return self
+
+    def _scanPacked(self, normalizedInstance, k):
+        """
+        Finds the k nearest training rows by going through the packed rows, with the same distances as
+        calculateDistance (features the instance doesn't have add nothing)
+        :return: the heap of the k nearest rows, as kept by _keepNearest
+        """
+        numericMatrix, numericCount = self.numericMatrix, len(self.numericAttributes)
+        codeMatrix, codeCount = self.codeMatrix, len(self.categoricalAttributes)
+        #the features the instance has in distance order, with its value
+        features = []
+        for isNumeric, j in self.features:
+            attr = self.numericAttributes[j] if isNumeric else self.categoricalAttributes[j]
+            if attr in normalizedInstance:
+                value = normalizedInstance[attr]
+                features.append((isNumeric, j, math.nan if value is None else value))
+
+        best = []
+        limit = _abandonLimit(best, k)
+        numericBase = codeBase = 0
         for i in range(len(self.data.featureData[self.targetAttribute])):
-            #create a dictionary for the training instance
-            trainInstance = {attr: self.normalizedData[attr][i] for attr in self.featureIndices}
+            distance = 0.0
+            for isNumeric, j, value in features:
+                if isNumeric:
+                    other = numericMatrix[numericBase + j]
+                    if value == value and other == other:
+                        distance += (value - other)**2
+                    #Missing values add the maxium possible distance
+                    else:
+                        distance += 1.0
+                else:
+                    other = codeMatrix[codeBase + j]
+                    if value != other or value < 0 or other < 0:
+                        distance += 1.0
+                if distance > limit:
+                    break
+            if distance <= limit:
+                _keepNearest(best, k, distance, i)
+                limit = _abandonLimit(best, k)
+            numericBase += numericCount
+            codeBase += codeCount
+        return best
 
-            #calculate distance
-            dist = self.calculateDistance(normalizedInstance, trainInstance)
-            targetValue = self.data.featureData[self.targetAttribute][i]
+    def _trainingBlocks(self):
+        """
+        Builds the blocks predictBatch compares queries with, once, from the dense training data: the normalized
+        numeric features (nan where there is no value) and the categorical codes of every training row
+        :return: (numeric block, code block), one column per attribute, or row-major matrices with numpy
+        """
+        if self._blocks is None:
+            targets = list(self.data.featureData[self.targetAttribute])
+            rowCount = len(targets)
+            #the packed rows already are the row-major matrices
+            if self.backend == 'numpy':
+                numeric = np.frombuffer(self.numericMatrix, dtype=np.float64).reshape(
+                    rowCount, len(self.numericAttributes))
+                codes = np.frombuffer(self.codeMatrix, dtype=np.intc).reshape(
+                    rowCount, len(self.categoricalAttributes)).astype(np.int64)
+            else:
+                numeric, codes = self._columnBlocks(self.normalizedData)
+            self._blocks = (numeric, codes, targets)
+        return self._blocks
 
-            distances.append((dist, targetValue))
+    def _columnBlocks(self, normalized):
+        """
+        :param normalized: attribute -> normalized column, as made by _normalizeData
+        :return: (numeric columns with nan where there is no value, code columns), in featureIndices order
+        """
+        numeric = [array('d', (math.nan if x is None else x for x in normalized[attr]))
+                   for attr in self.numericAttributes]
+        codes = [array('i', normalized[attr]) for attr in self.categoricalAttributes]
+        return numeric, codes
 
-        #sort by distance and get the k nearest
-        distances.sort(key=lambda x: x[0])
-        nearestNeighbors = distances[:self.k]
+    def _queryBlocks(self, testData):
+        """
+        Normalizes every row of testData the way normalizeInstance does
+        :return: (numeric block, code block), one column per attribute, or row-major matrices with numpy
+        """
+        numeric = []
+        for attr in self.numericAttributes:
+            values = (self._normalizeValue(attr, value) for value in testData.featureData[attr])
+            numeric.append(array('d', (math.nan if value is None else value for value in values)))
+        codes = []
+        for attr in self.categoricalAttributes:
+            column = testData.featureData[attr]
+            #data loaded with the training data as reference already has the training codes
+            if testData.dictionaries.get(attr) is self.data.dictionaries[attr]:
+                codes.append(array('i', column.codes))
+            else:
+                codes.append(array('i', map(self.data.dictionaries[attr].lookup, column)))
+        if self.backend == 'numpy':
+            rowCount = testData.rowCount()
+            numeric = np.array(numeric, dtype=np.float64).reshape(len(numeric), rowCount).T.copy()
+            codes = np.array(codes, dtype=np.int64).reshape(len(codes), rowCount).T.copy()
+        return numeric, codes
 
-        #get the most common value from the k nearest neighbors
-        neighborClasses = [neighbor[1] for neighbor in nearestNeighbors]
-        prediction = Counter(neighborClasses).most_common(1)[0][0]
+    def predictBatch(self, testData, workers=1):
+        """
+        Predicts the class of every row of a Data at once, with the same answers as predict
+        Both backends add up the same terms as calculateDistance in the same order, so the distances
+        come out exactly the same and ties still go to the training row that comes first
+        With approximate search switched on, or sparse training data, every row goes through predict instead
+        (sparse rows are compared entry by entry, expanding them into blocks would undo keeping them sparse)
+        :param testData: Data with the same attributes as the training data
+        :param workers: number of processes to split the test rows between (default: 1)
+        :return: the predicted class of every row
+        """
+        if self.approximateIndex is not None or self.sparse:
+            return [self.predict(instance) for instance in testData.instances()]
+        queryNumeric, queryCodes = self._queryBlocks(testData)
+        k = min(self.k, self.data.rowCount())
+        if workers > 1:
+            neighbors = self._parallelNeighbors(queryNumeric, queryCodes, k, testData.rowCount(), workers)
+        elif self.backend == 'numpy':
+            numeric, codes, targets = self._trainingBlocks()
+            neighbors = _numpyNeighbors(numeric, codes, queryNumeric, queryCodes, k, self.features)
+        else:
+            numeric, codes, targets = self._trainingBlocks()
+            neighbors = _pythonNeighbors(numeric, codes, queryNumeric, queryCodes, k, len(targets),
+                                         testData.rowCount(), self.features)
+        return [self.vote(nearest) for nearest in neighbors]
+
+    def _parallelNeighbors(self, queryNumeric, queryCodes, k, queryCount, workers):
+        """
+        Finds the neighbors of the queries in worker processes, each chunk of queries being a contiguous
+        run of rows. The packed training rows are copied into shared memory once and every worker reads
+        them from there, so they are never pickled, only the chunks and the neighbors found are
+        :return: the indices of each query's neighbors, nearest first
+        """
+        blocks = []
+        try:
+            for matrix in (self.numericMatrix, self.codeMatrix):
+                packed = memoryview(matrix).cast('B')
+                block = shared_memory.SharedMemory(create=True, size=max(1, len(packed)))
+                blocks.append(block)
+                block.buf[:len(packed)] = packed
 
-        return prediction
\ No newline at end of file
+            #a few chunks per worker so one slow chunk doesn't hold the rest up
+            chunkSize = max(1, math.ceil(queryCount / (workers * CHUNKS_PER_WORKER)))
+            chunks = []
+            for start in range(0, queryCount, chunkSize):
+                end = min(start + chunkSize, queryCount)
+                if self.backend == 'numpy':
+                    chunks.append((queryNumeric[start:end], queryCodes[start:end], end - start))
+                else:
+                    chunks.append(([column[start:end] for column in queryNumeric],
+                                   [column[start:end] for column in queryCodes], end - start))
+
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork') if 'fork' in methods else None
+            initargs = ([block.name for block in blocks], self.data.rowCount(), len(self.numericAttributes),
+                        len(self.categoricalAttributes), self.features, k, self.backend)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_initWorker, initargs=initargs) as pool:
+                #map gives the chunks back in order
+                return [nearest for neighbors in pool.map(_chunkNeighbors, chunks) for nearest in neighbors]
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def _featureColumns(self):
+        """
+        :return: for every feature in distance order, whether it is numeric and its column in that block
+        """
+        numericColumns = {attr: j for j, attr in enumerate(self.numericAttributes)}
+        codeColumns = {attr: j for j, attr in enumerate(self.categoricalAttributes)}
+        return [(True, numericColumns[attr]) if attr in numericColumns else (False, codeColumns[attr])
+                for attr in self.featureIndices]
+
+def _numpyNeighbors(numeric, codes, queryNumeric, queryCodes, k, features):
+    """
+    Finds the k nearest training rows of every query with numpy, a chunk of queries at a time
+    :param features: for every feature in distance order, whether it is numeric and its column in the blocks
+    :return: the indices of each query's neighbors, nearest first
+    """
+    rowCount = len(numeric)
+    #the distances, one feature's terms and its mask of missing values are in memory at once
+    chunkSize = max(1, BATCH_BYTES // (24 * max(1, rowCount)))
+    neighbors = []
+    for start in range(0, len(queryNumeric), chunkSize):
+        chunkNumeric = queryNumeric[start:start + chunkSize]
+        chunkCodes = queryCodes[start:start + chunkSize]
+        distances = np.zeros((len(chunkNumeric), rowCount))
+        for isNumeric, j in features:
+            if isNumeric:
+                difference = chunkNumeric[:, j, None] - numeric[None, :, j]
+                squared = difference * difference
+                #Missing values add the maxium possible distance
+                squared[np.isnan(difference)] = 1.0
+                distances += squared
+            #codes below 0 (missing or never seen) never match, a query code that isn't one always
+            #differs from a training code that is
+            else:
+                distances += (chunkCodes[:, j, None] != codes[None, :, j]) | (chunkCodes[:, j, None] < 0)
+        distances = np.sqrt(distances)
+
+        #the k smallest distances, with every row tied with the kth one sorted by row number
+        kth = np.partition(distances, k - 1, axis=1)[:, k - 1]
+        for row, limit in zip(distances, kth):
+            candidates = np.flatnonzero(row <= limit)
+            nearest = candidates[np.argsort(row[candidates], kind='stable')[:k]]
+            neighbors.append(nearest.tolist())
+    return neighbors
+
+def _pythonNeighbors(numeric, codes, queryNumeric, queryCodes, k, rowCount, queryCount, features):
+    """
+    Same as _numpyNeighbors without numpy: each query works down the training columns with map
+    :return: the indices of each query's neighbors, nearest first
+    """
+    hasMissing = [any(value != value for value in column) for column in numeric]
+    neighbors = []
+    for q in range(queryCount):
+        distances = [0.0] * rowCount
+        for isNumeric, j in features:
+            if isNumeric:
+                value = queryNumeric[j][q]
+                #Missing values add the maxium possible distance
+                if value != value:
+                    distances = list(map(add, distances, repeat(1.0)))
+                    continue
+                differences = list(map(value.__sub__, numeric[j]))
+                if hasMissing[j]:
+                    squared = [1.0 if d != d else d * d for d in differences]
+                else:
+                    squared = map(mul, differences, differences)
+                distances = list(map(add, distances, squared))
+            else:
+                code = queryCodes[j][q]
+                if code < 0:
+                    distances = list(map(add, distances, repeat(1.0)))
+                else:
+                    distances = list(map(add, distances, map(ne, codes[j], repeat(code))))
+        distances = list(map(math.sqrt, distances))
+        neighbors.append(heapq.nsmallest(k, range(rowCount), key=distances.__getitem__))
+    return neighbors
@@ -36,119 +36,34 @@ Note that it is relatively straightforward to adapt your classifier to predict n
 mode of the K nearest target values, you would report their mean (not required).
 """
 
-import re
-from typing import Dict, List, Tuple, Set
+import time
+from typing import Dict
 import KNN
+from arffReader import arffFile
 
 
-class Data:
-    def __init__(self):
-        self.attributes: Dict[str, str] = {}  # name -> type
-        self.featureData: Dict[str, List] = {}  # name -> list of values
-        self.numericStats: Dict[str, Dict[str, float]] = {}  # name -> {min, max}
-        self.discreteValues: Dict[str, Set] = {}  # name -> set of possible values
-
-    #Adds an attribute to data storage
-    def addAtributes(self, name: str, attributeType: str):
-        self.attributes[name] = attributeType
-        self.featureData[name] = []
-
-        #If discrete attribute get the possible values
-        if '{' in attributeType:
-            values = attributeType.strip('{}').split(',')
-            self.discreteValues[name] = {v.strip() for v in values}
-
-    #Adds a row of data values
-    def addDataToRow(self, values: List[str]):
-        for(name, value) in zip(self.attributes.keys(), values):
-            attributeType = self.attributes[name]
-
-            if 'numeric' in attributeType:
-                try:
-                    value = float(value)
-                except ValueError:
-                    print(f"Warning: Could not convert {value} to float for attribute {name}")
-                    value = None
-            self.featureData[name].append(value)
-
-    #A helper function to calculate stats
-    def calcStats(self):
-        for name, attributeType in self.attributes.items():
-            if 'numeric' in attributeType:
-                values = [x for x in self.featureData[name] if x is not None]
-                if values:
-                    self.numericStats[name] = {
-                        'min' : min(values),
-                        'max' : max(values)
-                  }
-            #For discrete attributes that weren't previously defined
-            elif name not in self.discreteValues and '{' not in attributeType:
-                self.discreteValues[name] = set(self.featureData[name])
-    def getFeatureType(self, attributeName):
-        if attributeName in self.attributes:
-            if 'numeric' in self.attributes[attributeName]:
-                return 'numeric'
-            else:
-                return 'discrete'
-        return None
-
-#Look through an .arff file and return arffData object
-def arffFile(filename: str) -> Data:
-    arffData = Data()
-
-    #used to check if after @data for actual data info
-    dataSection = False
-
-    #opens up the .arff file and goes through each line
-    with open(filename, 'r') as f:
-        for line in f:
-
-            #removes comments and removes tailing whitespaces
-            line = line.split('%')[0].strip()
-
-            #incase of empty lines keep going
-            if not line:
-                continue
-
-            # Look for attributes and what they are
-            if line.startswith('@attribute'):
-                match = re.match(r'@attribute\s+\'?([^\']+)\'?\s+([^\s].*)', line)
-                if match:
-                    attributeName, attributeType = match.groups()
-                    arffData.addAtributes(attributeName.strip(), attributeType.strip())
-
-            # Looks for data section
-            elif line.lower().startswith('@data'):
-                dataSection = True
-                continue
-
-            #If we're in data section get the values, separating by ,
-            elif dataSection:
-                values = [v.strip() for v in line.split(',')]
-
-                #So long as values is the same length on attributes save the data
-                if len(values) == len(arffData.attributes):
-                    arffData.addDataToRow(values)
-
-    #Calculate the stats once all data is grabbed
-    arffData.calcStats()
-    return arffData
-
-#Calculates the accuracy of the model on test data
-def evaluateModel(knnModel: KNN.KNN, testData: Data) -> float:
+#Calculates the accuracy of the model on test data, workers is how many processes share the test rows
+def evaluateModel(knnModel: KNN.KNN, testData, workers: int = 1) -> float:
     correct = 0
-    total = len(testData.featureData[knnModel.targetAttribute])
+    total = 0
 
-    #print("\nFirst few predictions: ")
+    #A loaded Data is predicted all at once by the batch distance engine
+    if hasattr(testData, 'featureData'):
+        predictions = knnModel.predictBatch(testData, workers)
+        for prediction, actual in zip(predictions, testData.featureData[knnModel.targetAttribute]):
+            total += 1
+            if prediction == actual:
+                correct += 1
+        return (correct / total)*100
 
-    #Create predictions for each instance in test data
-    for i in range(total):
-        # Create instance dictionary
-        instance = {attr: testData.featureData[attr][i] for attr in testData.attributes}
+    #print("\nFirst few predictions: ")
 
+    #Create predictions for each instance in test data (testData can also be an ArffStream)
+    for i, instance in enumerate(testData.instances()):
         # Get prediction
         prediction = knnModel.predict(instance)
-        actual = testData.featureData[knnModel.targetAttribute][i]
+        actual = instance[knnModel.targetAttribute]
+        total += 1
 
         #if i < 10:
             #print(f"Predicted: {prediction}, Actual: {actual}")
@@ -157,23 +72,53 @@ def evaluateModel(knnModel: KNN.KNN, testData: Data) -> float:
             correct += 1
     return (correct / total)*100
 
+#Compares approximate search (set up with knnModel.approximate()) with exact search on every test row:
+#recall@k is the share of the exact k nearest neighbors approximate search finds too, and the time is
+#the mean milliseconds a query takes to find its neighbors
+def approximateReport(knnModel: KNN.KNN, testData) -> Dict[str, float]:
+    exactTime = approximateTime = 0.0
+    found = wanted = 0
+    exactCorrect = approximateCorrect = total = 0
+
+    for instance in testData.instances():
+        start = time.perf_counter()
+        exact = knnModel.neighbors(instance, exact=True)
+        middle = time.perf_counter()
+        approximate = knnModel.neighbors(instance)
+        exactTime += middle - start
+        approximateTime += time.perf_counter() - middle
+
+        found += len(set(exact) & set(approximate))
+        wanted += len(exact)
+        actual = instance[knnModel.targetAttribute]
+        total += 1
+        if knnModel.vote(exact) == actual:
+            exactCorrect += 1
+        if knnModel.vote(approximate) == actual:
+            approximateCorrect += 1
+
+    return {'recall': found / wanted, 'exactMs': exactTime * 1000 / total,
+            'approximateMs': approximateTime * 1000 / total, 'exactAccuracy': (exactCorrect / total)*100,
+            'approximateAccuracy': (approximateCorrect / total)*100}
+
 #the main section of the program
 def main():
     try:
         # Get the training data
         trainFile = input("Please input training file name (making sure to add extension): ")
-        trainData = arffFile(trainFile)
+        trainData = arffFile(trainFile, cache=True)
 
 
         #Get test data
         testFile = input("Please input testing file name (making sure to add extension): ")
-        testData = arffFile(testFile)
+        testData = arffFile(testFile, reference=trainData, cache=True)
 
         #Get the target attribute from available attributes
         print("\nAvailable attributes: ", list(trainData.attributes.keys()))
         targetAttribute = input("Enter the target attribute name: ")
 
         kValue = int(input("Enter the k value for KNN: "))
+        workers = int(input("Enter the number of worker processes (default: 1): ") or 1)
 
         #Print the target values
         print("\nTarget values in training: ", set(trainData.featureData[targetAttribute]))
@@ -185,9 +130,18 @@ def main():
 
         #Evaluate on the test data
         print("\nEvaluating on test data...")
-        accuracy = evaluateModel(knn, testData)
+        accuracy = evaluateModel(knn, testData, workers)
         print(f"\nAccuracy on test data: {accuracy:.1f}%")
 
+        #Approximate search trades some accuracy for faster queries
+        if input("\nCompare with approximate search? (y/n, default: n): ").strip().lower() == 'y':
+            knn.approximate()
+            report = approximateReport(knn, testData)
+            print(f"Recall@{knn.k}: {report['recall']:.3f}")
+            print(f"Exact search: {report['exactMs']:.3f} ms per query, {report['exactAccuracy']:.1f}% accuracy")
+            print(f"Approximate search: {report['approximateMs']:.3f} ms per query, "
+                  f"{report['approximateAccuracy']:.1f}% accuracy")
+
     except FileNotFoundError as e:
         print(f"Error: File not found - {str(e)}")
     except Exception as e:
@@ -4,7 +4,8 @@ Naive Bayes implementation (categorical features only)
 """
 import math
 from typing import Dict, List, Any, Set
-from collections import defaultdict
+from collections import Counter, defaultdict
+from arffReader import SparseInstance
 
 class NaiveBays:
     def __init__(self, trainData, targetAttribute: str, use_Laplace=True):
@@ -16,11 +17,20 @@ class NaiveBays:
         #Get all the descriptive features except for the target
         self.features = [attr for attr in trainData.attributes if attr != targetAttribute]
 
+        #Sparse data is counted in one pass over its stored entries instead of column by column
+        self.sparse = trainData.isSparse()
+        sparseCounts = self._countSparse(trainData) if self.sparse else None
+
         #Store possible values for each feature
         self.featureValues = {}
         for feature in self.features:
             if feature in trainData.discreteValues:
                 self.featureValues[feature] = list(trainData.discreteValues[feature])
+            elif self.sparse:
+                values = set()
+                for valueCounts in sparseCounts[feature].values():
+                    values.update(valueCounts)
+                self.featureValues[feature] = list(values)
             else:
                 self.featureValues[feature] = list(set(trainData.featureData[feature]))
 
@@ -39,10 +49,46 @@ class NaiveBays:
         self.conditionalProbabilities = {}
 
         #train the model
-        self._train(trainData)
+        self._train(trainData, sparseCounts)
+
+    #count the (class, feature value) pairs of every feature in one pass over the stored entries of sparse data
+    def _countSparse(self, trainData):
+        names = trainData.attributeNames
+        targetCodes = trainData.featureData[self.targetAttribute].codes
+        decoders = [trainData.dictionaries[name].decode if name in trainData.dictionaries else None
+                    for name in names]
+
+        #feature -> class code -> feature value -> count, None counts the missing values
+        counts = {feature: defaultdict(lambda: defaultdict(int)) for feature in self.features}
+        #feature -> class code -> how many rows store an entry for the feature
+        storedCounts = {feature: defaultdict(int) for feature in self.features}
+
+        rows = trainData.sparseRows
+        for i, targetCode in enumerate(targetCodes):
+            for index, value in rows.row(i):
+                feature = names[index]
+                if feature == self.targetAttribute:
+                    continue
+                decode = decoders[index]
+                if decode is not None:
+                    featValue = decode(int(value))
+                else:
+                    featValue = None if math.isnan(value) else value
+                counts[feature][targetCode][featValue] += 1
+                storedCounts[feature][targetCode] += 1
+
+        #every row that left a feature out holds its default value
+        classCodeCounts = Counter(targetCodes)
+        defaults = trainData.defaults()
+        for feature in self.features:
+            for targetCode, total in classCodeCounts.items():
+                leftOut = total - storedCounts[feature][targetCode]
+                if leftOut:
+                    counts[feature][targetCode][defaults[feature]] += leftOut
+        return counts
 
     #train the naive bayes model on the data
-    def _train(self, trainData):
+    def _train(self, trainData, sparseCounts=None):
         totalInstance = len(trainData.featureData[self.targetAttribute])
 
         #Count class occurances
@@ -68,22 +114,38 @@ class NaiveBays:
                 self.conditionalProbabilities[targetValue][feature] = {}
 
         #calculate the conditional probabilities for each feature value in each class
+        targetCodes = trainData.featureData[self.targetAttribute].codes
+        targetDictionary = trainData.dictionaries[self.targetAttribute]
         for feature in self.features:
             featureValue = self.featureValues[feature]
+            column = trainData.featureData[feature]
+
+            #count every (class, feature value) pair in one pass over the column
+            #categorical columns are counted by their codes, numeric ones by their raw values
+            if sparseCounts is not None:
+                pairCounts = {(targetCode, featValue): count
+                              for targetCode, valueCounts in sparseCounts[feature].items()
+                              for featValue, count in valueCounts.items()}
+                decode = None
+            elif feature in trainData.dictionaries:
+                pairCounts = Counter(zip(targetCodes, column.codes))
+                decode = column.dictionary.decode
+            else:
+                pairCounts = Counter(zip(targetCodes, column))
+                decode = None
+
+            #group the counts by class, leaving out missing values
+            classValueCounts = defaultdict(lambda: defaultdict(int))
+            for (targetCode, key), count in pairCounts.items():
+                featValue = decode(key) if decode else key
+                if featValue is not None:
+                    classValueCounts[targetCode][featValue] += count
 
             #for each class
             for targetValue in self.targetValues:
-                #count how many times each feature value is in the class
-                valueCounts = defaultdict(int)
-                classTotal = 0
-
-                #count the times
-                for i in range(totalInstance):
-                    if trainData.featureData[self.targetAttribute][i] == targetValue:
-                        featValue = trainData.featureData[feature][i]
-                        if featValue is not None:
-                            valueCounts[featValue] += 1
-                            classTotal += 1
+                #how many times each feature value is in the class
+                valueCounts = classValueCounts.get(targetDictionary.lookup(targetValue), {})
+                classTotal = sum(valueCounts.values())
 
                 #calculate the probabilities for the feature values
                 for featValue in featureValue:
@@ -98,8 +160,60 @@ class NaiveBays:
                     #store it in our 3d structure
                     self.conditionalProbabilities[targetValue][feature][featValue] = prob
 
+        #For sparse data keep the log probability of every feature holding its default, so predicting
+        #only has to correct for the features an instance actually stores
+        if self.sparse:
+            self.defaultValues = {feature: value for feature, value in trainData.defaults().items()
+                                  if feature != self.targetAttribute}
+            self.defaultLogProbs = {}
+            self.defaultLogTotals = {}
+            for targetValue in self.targetValues:
+                logProbs = {}
+                for feature, default in self.defaultValues.items():
+                    prob = self._probability(targetValue, feature, default)
+                    logProbs[feature] = math.log(prob) if prob > 0 else float('-inf')
+                self.defaultLogProbs[targetValue] = logProbs
+                self.defaultLogTotals[targetValue] = sum(logProbs.values())
+
+    #probability of a feature value given a class, with the same handling of unseen values as predict
+    def _probability(self, targetValue, feature, featValue):
+        if featValue in self.conditionalProbabilities[targetValue][feature]:
+            return self.conditionalProbabilities[targetValue][feature][featValue]
+        #with smoothing unseen values get a small probability, w/out laplace it is 0
+        if self.useLaplace:
+            return 1 / (len(self.featureValues[feature])+1)
+        return 0
+
+    #predict the class of a sparse instance by only looking at the values it stores
+    #(only used with laplace smoothing, where no probability is 0)
+    def _predictSparse(self, instance):
+        bestClass = None
+        bestProb = float('-inf')
+
+        for targetValue in self.targetValues:
+            defaultLogProbs = self.defaultLogProbs[targetValue]
+            #start as if every feature held its default
+            logProb = math.log(self.previous[targetValue]) + self.defaultLogTotals[targetValue]
+
+            for feature, featValue in instance.items():
+                if feature not in defaultLogProbs or featValue == self.defaultValues[feature]:
+                    continue
+                #swap the default's probability for this value's, missing values are skipped
+                logProb -= defaultLogProbs[feature]
+                if featValue is not None:
+                    logProb += math.log(self._probability(targetValue, feature, featValue))
+
+            if logProb > bestProb:
+                bestProb = logProb
+                bestClass = targetValue
+
+        return bestClass
+
     #predict the class for a given instance
     def predict(self, instance):
+        if self.sparse and self.useLaplace and isinstance(instance, SparseInstance):
+            return self._predictSparse(instance)
+
         bestClass = None
         bestProb = float('-inf')
 
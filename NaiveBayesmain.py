@@ -18,119 +18,24 @@ descriptive feature.
 predicting: pH
 """
 
-import re
-from typing import Dict, List, Tuple, Set
 import NB
+from arffReader import arffFile
+from discretizer import Discretizer
 
 
-class Data:
-    def __init__(self):
-        self.attributes: Dict[str, str] = {}  # name -> type
-        self.featureData: Dict[str, List] = {}  # name -> list of values
-        self.numericStats: Dict[str, Dict[str, float]] = {}  # name -> {min, max}
-        self.discreteValues: Dict[str, Set] = {}  # name -> set of possible values
-
-    #Adds an attribute to data storage
-    def addAtributes(self, name: str, attributeType: str):
-        self.attributes[name] = attributeType
-        self.featureData[name] = []
-
-        #If discrete attribute get the possible values
-        if '{' in attributeType:
-            values = attributeType.strip('{}').split(',')
-            self.discreteValues[name] = {v.strip() for v in values}
-
-    #Adds a row of data values
-    def addDataToRow(self, values: List[str]):
-        for(name, value) in zip(self.attributes.keys(), values):
-            attributeType = self.attributes[name]
-
-            if 'numeric' in attributeType:
-                try:
-                    value = float(value)
-                except ValueError:
-                    print(f"Warning: Could not convert {value} to float for attribute {name}")
-                    value = None
-            self.featureData[name].append(value)
-
-    #A helper function to calculate stats
-    def calcStats(self):
-        for name, attributeType in self.attributes.items():
-            if 'numeric' in attributeType:
-                values = [x for x in self.featureData[name] if x is not None]
-                if values:
-                    self.numericStats[name] = {
-                        'min' : min(values),
-                        'max' : max(values)
-                  }
-            #For discrete attributes that weren't previously defined
-            elif name not in self.discreteValues and '{' not in attributeType:
-                self.discreteValues[name] = set(self.featureData[name])
-    def getFeatureType(self, attributeName):
-        if attributeName in self.attributes:
-            if 'numeric' in self.attributes[attributeName]:
-                return 'numeric'
-            else:
-                return 'discrete'
-        return None
-
-#Look through an .arff file and return arffData object
-def arffFile(filename: str) -> Data:
-    arffData = Data()
-
-    #used to check if after @data for actual data info
-    dataSection = False
-
-    #opens up the .arff file and goes through each line
-    with open(filename, 'r') as f:
-        for line in f:
-
-            #removes comments and removes tailing whitespaces
-            line = line.split('%')[0].strip()
-
-            #incase of empty lines keep going
-            if not line:
-                continue
-
-            # Look for attributes and what they are
-            if line.startswith('@attribute'):
-                match = re.match(r'@attribute\s+\'?([^\']+)\'?\s+([^\s].*)', line)
-                if match:
-                    attributeName, attributeType = match.groups()
-                    arffData.addAtributes(attributeName.strip(), attributeType.strip())
-
-            # Looks for data section
-            elif line.lower().startswith('@data'):
-                dataSection = True
-                continue
-
-            #If we're in data section get the values, separating by ,
-            elif dataSection:
-                values = [v.strip() for v in line.split(',')]
-
-                #So long as values is the same length on attributes save the data
-                if len(values) == len(arffData.attributes):
-                    arffData.addDataToRow(values)
-
-    #Calculate the stats once all data is grabbed
-    arffData.calcStats()
-    return arffData
-
 #Calculates the accuracy of the model on test data
-def evaluateModel(nbModel: NB.NaiveBays, testData: Data) -> float:
+def evaluateModel(nbModel: NB.NaiveBays, testData) -> float:
     correct = 0
-    total = len(testData.featureData[nbModel.targetAttribute])
+    total = 0
 
     #print("\nFirst few predictions: ")
 
-    #Create predictions for each instance in test data
-    for i in range(total):
-        # Create instance dictionary
-        instance = {attr: testData.featureData[attr][i] for attr in testData.attributes}
-
+    #Create predictions for each instance in test data (testData can also be an ArffStream)
+    for i, instance in enumerate(testData.instances()):
         # Get prediction
         prediction = nbModel.predict(instance)
-        actual = testData.featureData[nbModel.targetAttribute][i]
+        actual = instance[nbModel.targetAttribute]
+        total += 1
 
         #if i < 10:
             #print(f"Predicted: {prediction}, Actual: {actual}")
@@ -144,17 +49,23 @@ def main():
     try:
         # Get the training data
         trainFile = input("Please input training file name (making sure to add extension): ")
-        trainData = arffFile(trainFile)
+        trainData = arffFile(trainFile, cache=True)
 
 
         #Get test data
         testFile = input("Please input testing file name (making sure to add extension): ")
-        testData = arffFile(testFile)
+        testData = arffFile(testFile, reference=trainData, cache=True)
 
         #Get the target attribute from available attributes
         print("\nAvailable attributes: ", list(trainData.attributes.keys()))
         targetAttribute = input("Enter the target attribute name: ")
 
+        #Numeric attributes are binned first, with the bins fit on the training data
+        if any(trainData.getFeatureType(name) == 'numeric' for name in trainData.attributes):
+            method = input("Numeric attributes found, binning method (width/frequency/entropy, default: width): ").lower()
+            discretizer = Discretizer(method or 'width', targetAttribute=targetAttribute).fit(trainData)
+            trainData, testData = discretizer.transform(trainData), discretizer.transform(testData)
+
         # ask if laplace smoothing should be used, default is yes, also lowers the input from user
         useLaplace = input("\nUse Laplace smoothing? (y/n, default: y): ").lower()
         useLaplace = useLaplace != 'n' or 'no'
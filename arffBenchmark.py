@@ -0,0 +1,119 @@
+"""
+Name: Rowan Noel-Rickert
+
+Micro-benchmark for the .arff @data path.  Writes a synthetic file (1,000,000 rows by default, half
+numeric and half discrete attributes) and reports rows/sec for the original reader (Data and arffFile as
+they were in main.py before arffReader.py, read out of git history) against arffFile now (best of 3 loads
+each). revision is the commit to take main.py from, by default the parent of the commit that added
+arffReader.py.
+
+    python arffBenchmark.py [rows] [revision]
+"""
+
+import contextlib
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from arffReader import arffFile
+
+NUMERIC_ATTRIBUTES = 6
+DISCRETE_ATTRIBUTES = 6
+DISCRETE_VALUES = ['red', 'green', 'blue', 'yellow']
+
+
+#Writes a synthetic .arff file with the given number of rows, with a missing value now and then
+def writeSyntheticFile(filename: str, rows: int, seed: int = 570):
+    rng = random.Random(seed)
+    with open(filename, 'w') as f:
+        f.write("@relation synthetic\n\n")
+        for i in range(NUMERIC_ATTRIBUTES):
+            f.write(f"@attribute n{i} numeric\n")
+        for i in range(DISCRETE_ATTRIBUTES):
+            f.write(f"@attribute d{i} {{{','.join(DISCRETE_VALUES)}}}\n")
+        f.write("\n@data\n")
+        for _ in range(rows):
+            values = [f"{rng.uniform(-100, 100):.4f}" for _ in range(NUMERIC_ATTRIBUTES)]
+            values += [rng.choice(DISCRETE_VALUES) for _ in range(DISCRETE_ATTRIBUTES)]
+            if rng.random() < 0.01:
+                values[rng.randrange(len(values))] = '?'
+            f.write(','.join(values) + '\n')
+
+
+#Runs git in the folder this file is in and gives back what it printed
+def git(*args) -> str:
+    folder = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.run(['git', *args], cwd=folder, capture_output=True, text=True, check=True).stdout
+
+
+#Loads main.py from the given commit as a module, its Data and arffFile are the original reader
+def baselineReader(revision: str = None) -> types.ModuleType:
+    if revision is None:
+        #the oldest commit that added arffReader.py, its parent still has the reader in main.py
+        revision = git('log', '--diff-filter=A', '--format=%H', '--', 'arffReader.py').split()[-1] + '^'
+    source = git('show', f'{revision}:main.py')
+    module = types.ModuleType('baselineReader')
+    exec(compile(source, f'{revision}:main.py', 'exec'), module.__dict__)
+    return module
+
+
+def compiledLoad(filename: str):
+    return arffFile(filename)
+
+
+#The rows a Data from either reader holds
+def rowCount(arffData) -> int:
+    return len(next(iter(arffData.featureData.values()), []))
+
+
+#What the two reads have to agree on: the row count, the min and max of each numeric attribute and the
+#values of each discrete attribute
+def summary(arffData):
+    stats = {name: (s['min'], s['max']) for name, s in arffData.numericStats.items()}
+    return rowCount(arffData), stats, arffData.discreteValues
+
+
+#Loads filename with each load in turn for a few rounds (so a slow stretch of the machine doesn't land on
+#just one of them) and gives back (best rows/sec, summary) for each
+#Only the summary is kept, a loaded Data left around would slow the garbage collector down for the next load
+#The original reader prints a warning for every missing value, that output is thrown away for both
+def timeLoads(loads, filename: str, repeats: int = 3):
+    best = [math.inf] * len(loads)
+    summaries = [None] * len(loads)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeats):
+            for i, load in enumerate(loads):
+                start = time.perf_counter()
+                arffData = load(filename)
+                best[i] = min(best[i], time.perf_counter() - start)
+                summaries[i] = summary(arffData)
+                del arffData
+    return [(read[0] / seconds, read) for seconds, read in zip(best, summaries)]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    baseline = baselineReader(sys.argv[2] if len(sys.argv) > 2 else None)
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'synthetic.arff')
+        print(f"Writing {rows} rows to {filename}")
+        writeSyntheticFile(filename, rows)
+
+        (baselineRate, baselineSummary), (compiledRate, compiledSummary) = timeLoads(
+            [baseline.arffFile, compiledLoad], filename)
+
+    #both have to read the same thing for the numbers to mean anything
+    if baselineSummary != compiledSummary:
+        print("Warning: the two loads disagree")
+    print(f"original reader:    {baselineRate:12,.0f} rows/sec")
+    print(f"compiled decoders:  {compiledRate:12,.0f} rows/sec")
+    print(f"speedup:            {compiledRate / baselineRate:12.2f}x")
+
+
+if __name__ == "__main__":
+    main()
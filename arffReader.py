@@ -0,0 +1,1250 @@
+"""
+Name: Rowan Noel-Rickert
+
+Shared .arff reader used by every main in this repository.
+
+arffFile(filename) loads a whole file into a Data object, the same as the original homework reader.
+ArffStream(filename) reads only the header up front and then hands back rows (or fixed-size Data
+chunks) as they are parsed, so a model can start working before the file is fully read.
+Both take a path or an open binary file object, and gzip, bz2 and xz input is decompressed as it is read.
+"""
+
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import math
+import mmap
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Set
+from dataStats import CategoricalStats, NumericStats
+
+
+#Maps the values of one categorical attribute to integer codes (shared between train and test Data)
+class CategoryDictionary:
+    def __init__(self, values=()):
+        self.values: List[str] = []  # code -> value
+        self.codes: Dict[str, int] = {}  # value -> code
+        for value in values:
+            self.encode(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    #Gives back the code for a value, adding it if it hasn't been seen before
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    #Gives back the code for a value without adding it, -1 for missing and -2 for unseen values
+    def lookup(self, value) -> int:
+        if value is None:
+            return -1
+        return self.codes.get(value, -2)
+
+    def decode(self, code: int):
+        return self.values[code] if 0 <= code < len(self.values) else None
+
+
+#Numeric column stored as packed doubles with a missing value mask (1 = missing)
+#Columns loaded from a cache hold read-only memoryviews instead of arrays
+#stats is kept up to date as values are appended
+class NumericColumn:
+    def __init__(self, values=None, missing=None, stats: Optional[NumericStats] = None):
+        self.values = array('d') if values is None else values
+        self.missing = bytearray() if missing is None else missing
+        self.stats = NumericStats() if stats is None else stats
+
+    def append(self, value):
+        if value is None:
+            self.values.append(math.nan)
+            self.missing.append(1)
+            self.stats.addMissing()
+        else:
+            self.values.append(value)
+            self.missing.append(0)
+            self.stats.add(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return None if self.missing[i] else self.values[i]
+
+    def __iter__(self):
+        for value, missing in zip(self.values, self.missing):
+            yield None if missing else value
+
+
+#Categorical column stored as integer codes into a CategoryDictionary (-1 = missing)
+class CategoricalColumn:
+    def __init__(self, dictionary: CategoryDictionary, codes=None, stats: Optional[CategoricalStats] = None):
+        self.dictionary = dictionary
+        self.codes = array('i') if codes is None else codes
+        self.stats = CategoricalStats() if stats is None else stats
+
+    def append(self, value):
+        code = -1 if value is None else self.dictionary.encode(value)
+        self.codes.append(code)
+        self.stats.add(code)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.dictionary.decode(self.codes[i])
+
+    def __iter__(self):
+        values = self.dictionary.values
+        for code in self.codes:
+            yield values[code] if code >= 0 else None
+
+
+#Row-major storage for sparse .arff files, only the entries that differ from their default are kept
+#Categorical entries are stored as their code, missing values as NaN
+class SparseRows:
+    def __init__(self, rowStarts=None, indices=None, values=None):
+        self.rowStarts = array('q', [0]) if rowStarts is None else rowStarts  # row -> first entry
+        self.indices = array('i') if indices is None else indices  # entry -> attribute index
+        self.values = array('d') if values is None else values  # entry -> value
+
+    def __len__(self):
+        return len(self.rowStarts) - 1
+
+    #Adds a row from (attribute index, value) pairs sorted by attribute index
+    def addRow(self, entries):
+        for index, value in entries:
+            self.indices.append(index)
+            self.values.append(value)
+        self.rowStarts.append(len(self.indices))
+
+    #Gives back the (attribute index, value) pairs stored for a row
+    def row(self, i):
+        start, end = self.rowStarts[i], self.rowStarts[i + 1]
+        return zip(self.indices[start:end], self.values[start:end])
+
+    #Gives back the stored value of one attribute in a row
+    def get(self, i, attributeIndex: int, default: float) -> float:
+        start, end = self.rowStarts[i], self.rowStarts[i + 1]
+        position = bisect_left(self.indices, attributeIndex, start, end)
+        if position < end and self.indices[position] == attributeIndex:
+            return self.values[position]
+        return default
+
+    #Expands one attribute into a dense array
+    def column(self, attributeIndex: int, default: float) -> array:
+        dense = array('d', [default]) * len(self)
+        for i in range(len(self)):
+            dense[i] = self.get(i, attributeIndex, default)
+        return dense
+
+
+#Read-only numeric column view over SparseRows, left out entries are 0
+#storedStats only covers the stored entries, stats adds in the left out ones
+class SparseNumericColumn:
+    def __init__(self, rows: SparseRows, attributeIndex: int, storedStats: Optional[NumericStats] = None):
+        self.rows = rows
+        self.attributeIndex = attributeIndex
+        self.default = 0.0
+        self.storedStats = NumericStats() if storedStats is None else storedStats
+
+    @property
+    def stats(self) -> NumericStats:
+        stats = self.storedStats.copy()
+        stats.addRepeated(self.default, len(self.rows) - stats.count - stats.missing)
+        return stats
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        value = self.rows.get(i, self.attributeIndex, self.default)
+        return None if math.isnan(value) else value
+
+    def __iter__(self):
+        for value in self.values:
+            yield None if math.isnan(value) else value
+
+    #Dense copies, for code written against NumericColumn
+    @property
+    def values(self) -> array:
+        return self.rows.column(self.attributeIndex, self.default)
+
+    @property
+    def missing(self) -> bytearray:
+        return bytearray(math.isnan(value) for value in self.values)
+
+
+#Read-only categorical column view over SparseRows, left out entries are the default code
+class SparseCategoricalColumn:
+    def __init__(self, rows: SparseRows, attributeIndex: int, dictionary: CategoryDictionary, default: int = 0,
+                 storedStats: Optional[CategoricalStats] = None):
+        self.rows = rows
+        self.attributeIndex = attributeIndex
+        self.dictionary = dictionary
+        self.default = default
+        self.storedStats = CategoricalStats() if storedStats is None else storedStats
+
+    @property
+    def stats(self) -> CategoricalStats:
+        stats = self.storedStats.copy()
+        stats.addRepeated(self.default, len(self.rows) - stats.count() - stats.missing)
+        return stats
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return self.dictionary.decode(int(self.rows.get(i, self.attributeIndex, self.default)))
+
+    def __iter__(self):
+        values = self.dictionary.values
+        for code in self.codes:
+            yield values[code] if code >= 0 else None
+
+    #Dense copy of the codes, for code written against CategoricalColumn
+    @property
+    def codes(self) -> array:
+        return array('i', map(int, self.rows.column(self.attributeIndex, self.default)))
+
+
+#A sparse row: only the non-default values are stored, anything else reads as its default
+class SparseInstance(dict):
+    def __init__(self, entries, defaults: Dict):
+        super().__init__(entries)
+        self.defaults = defaults
+
+    def __missing__(self, key):
+        return self.defaults[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.defaults
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        return self.defaults.get(key, default)
+
+
+#Rows are added ROW_BLOCK at a time, each column of a block going through its decoder in one call
+ROW_BLOCK = 1000
+
+
+#Decoder for a numeric column: parses the raw strings of a block of rows and appends them along with
+#their stats
+def _numericDecoder(name: str, column: NumericColumn):
+    appendValue, appendMissing = column.values.append, column.missing.append
+    stats = column.stats
+
+    def decode(values):
+        #a block is parsed in one go once its ? (missing) values are swapped for nan
+        values = list(values)
+        missing = []
+        try:
+            while True:
+                position = values.index('?', missing[-1] + 1 if missing else 0)
+                missing.append(position)
+                values[position] = 'nan'
+        except ValueError:
+            pass
+        try:
+            numbers = array('d', map(float, values))
+        except ValueError:
+            numbers = None
+        if numbers is not None:
+            column.values.extend(numbers)
+            mask = bytearray(len(numbers))
+            for position in reversed(missing):
+                mask[position] = 1
+                del numbers[position]
+            column.missing.extend(mask)
+            stats.missing += len(missing)
+            stats.addBlock(numbers)
+            return
+
+        #anything else that doesn't parse (with a warning) goes value by value
+        for position in missing:
+            values[position] = '?'
+        present = array('d')
+        for value in values:
+            try:
+                number = float(value)
+            except ValueError:
+                value = value.strip()
+                #? is how .arff marks a missing value
+                if value != '?':
+                    print(f"Warning: Could not convert {value} to float for attribute {name}")
+                appendValue(math.nan)
+                appendMissing(1)
+                stats.addMissing()
+                continue
+            appendValue(number)
+            appendMissing(0)
+            present.append(number)
+        stats.addBlock(present)
+    return decode
+
+
+#Converter for a numeric column: parses the raw string into the float rows() and instances() give back,
+#None when it is missing
+def _numericConverter(name: str):
+    def convert(value: str):
+        try:
+            return float(value)
+        except ValueError:
+            value = value.strip()
+            #? is how .arff marks a missing value
+            if value != '?':
+                print(f"Warning: Could not convert {value} to float for attribute {name}")
+            return None
+    return convert
+
+
+#Decoder for a categorical column: looks the raw strings of a block of rows up (stripping one only
+#when that misses) and appends their codes along with their stats
+def _categoricalDecoder(column: CategoricalColumn):
+    lookup, encode = column.dictionary.codes.get, column.dictionary.encode
+    addRepeated = column.stats.addRepeated
+
+    def decode(values):
+        found = list(map(lookup, values))
+        if None in found:
+            found = [encode(value.strip()) if code is None else code for code, value in zip(found, values)]
+        column.codes.extend(found)
+        for code, count in Counter(found).items():
+            addRepeated(code, count)
+    return decode
+
+
+class Data:
+    def __init__(self):
+        self.attributes: Dict[str, str] = {}  # name -> type
+        self.featureData: Dict[str, object] = {}  # name -> NumericColumn or CategoricalColumn
+        self.numericStats: Dict[str, Dict[str, float]] = {}  # name -> {min, max, count, missing, mean, variance}
+        self.discreteValues: Dict[str, Set] = {}  # name -> set of possible values
+        self.dictionaries: Dict[str, CategoryDictionary] = {}  # name -> value codes for categorical attributes
+        self.attributeNames: List[str] = []  # attribute index -> name
+        self.sparseRows: Optional[SparseRows] = None  # set when rows are stored sparsely
+        self.sketchSize = 0  # size of the quantile sketch kept for numeric columns, 0 for none
+        self._decoders = None  # attribute index -> decoder, see _compileDecoders
+        self._converters = None  # attribute index -> converter, see _compileConverters
+        self._cacheMap = None  # (mmap, views into it) when the columns were loaded from a cache, see close
+
+    #The decoders and converters are closures that can't be pickled (e.g. when a worker sends a chunk back),
+    #they get rebuilt
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_decoders'] = None
+        state['_converters'] = None
+        state['_cacheMap'] = None
+        return state
+
+    #Unmaps the cache file the columns of a cached Data are views into, the Data can't be used afterwards
+    #(the file is also unmapped once the Data and its columns are garbage collected)
+    def close(self):
+        if self._cacheMap is None:
+            return
+        mapped, views = self._cacheMap
+        self._cacheMap = None
+        self.featureData = {}
+        self.sparseRows = None
+        for view in views:
+            view.release()
+        mapped.close()
+
+    #Adds an attribute to data storage
+    def addAtributes(self, name: str, attributeType: str, dictionary: Optional[CategoryDictionary] = None):
+        self.attributes[name] = attributeType
+        self.attributeNames.append(name)
+        self._decoders = None
+        self._converters = None
+
+        if 'numeric' in attributeType:
+            self.featureData[name] = NumericColumn(stats=NumericStats(self.sketchSize))
+            return
+
+        #If discrete attribute get the possible values
+        declared = self._declaredValues(name)
+        if '{' in attributeType:
+            self.discreteValues[name] = set(declared)
+
+        #Declared values get their codes in the order they were declared
+        if dictionary is None:
+            dictionary = CategoryDictionary(declared)
+        else:
+            for value in declared:
+                dictionary.encode(value)
+        self.dictionaries[name] = dictionary
+        self.featureData[name] = CategoricalColumn(dictionary)
+
+    #Keeps a quantile sketch of size k for every numeric column, must be called before any rows are added
+    def trackQuantiles(self, k: int = 200):
+        if self.rowCount():
+            raise ValueError("trackQuantiles needs an empty Data")
+        self.sketchSize = k
+        self._decoders = None
+        for column in self.featureData.values():
+            if isinstance(column, SparseNumericColumn):
+                column.storedStats = NumericStats(k)
+            elif isinstance(column, NumericColumn):
+                column.stats = NumericStats(k)
+
+    #Switches to sparse row storage, must be called before any rows are added
+    #Left out numeric values are 0 and left out categorical values are the first declared value
+    def makeSparse(self, rows: Optional[SparseRows] = None):
+        if self.rowCount():
+            raise ValueError("makeSparse needs an empty Data")
+        self.sparseRows = SparseRows() if rows is None else rows
+        self._decoders = None
+        for index, name in enumerate(self.attributeNames):
+            column = self.featureData[name]
+            if isinstance(column, NumericColumn):
+                self.featureData[name] = SparseNumericColumn(self.sparseRows, index, column.stats)
+            else:
+                declared = self._declaredValues(name)
+                default = column.dictionary.codes[declared[0]] if declared else 0
+                self.featureData[name] = SparseCategoricalColumn(self.sparseRows, index, column.dictionary, default,
+                                                                 column.stats)
+
+    def isSparse(self) -> bool:
+        return self.sparseRows is not None
+
+    #The declared values of a nominal attribute, in order
+    def _declaredValues(self, name: str) -> List[str]:
+        attributeType = self.attributes[name]
+        if '{' not in attributeType:
+            return []
+        return [v.strip().strip('\'"') for v in attributeType.strip('{}').split(',')]
+
+    #What each attribute reads as when a sparse row leaves it out
+    def defaults(self) -> Dict:
+        defaults = {}
+        for name in self.attributeNames:
+            column = self.featureData[name]
+            if isinstance(column, SparseCategoricalColumn):
+                defaults[name] = column.dictionary.decode(column.default)
+            elif isinstance(column, SparseNumericColumn):
+                defaults[name] = column.default
+            elif name in self.dictionaries:
+                declared = self._declaredValues(name)
+                defaults[name] = declared[0] if declared else self.dictionaries[name].decode(0)
+            else:
+                defaults[name] = 0.0
+        return defaults
+
+    #Switches categorical attributes over to the dictionaries of another Data (e.g. the training set)
+    #so the same value gets the same code in both
+    def shareDictionaries(self, reference: 'Data'):
+        self._decoders = None
+        for index, name in enumerate(self.attributeNames):
+            dictionary = self.dictionaries.get(name)
+            shared = reference.dictionaries.get(name)
+            if dictionary is None or shared is None or shared is dictionary:
+                continue
+            for value in dictionary.values:
+                shared.encode(value)
+            column = self.featureData[name]
+            remap = [shared.codes[value] for value in dictionary.values]
+            identity = remap == list(range(len(remap)))
+            self.dictionaries[name] = shared
+
+            if self.sparseRows is not None:
+                stats = column.storedStats
+                #codes only need rewriting when the two dictionaries disagree
+                if not identity:
+                    stats.remap(remap)
+                    rows = self.sparseRows
+                    #rows memory-mapped from a cache are read-only
+                    if not isinstance(rows.values, array):
+                        rows.values = array('d', rows.values)
+                    for position, attributeIndex in enumerate(rows.indices):
+                        if attributeIndex == index:
+                            rows.values[position] = remap[int(rows.values[position])]
+                default = remap[column.default] if column.default < len(remap) else column.default
+                self.featureData[name] = SparseCategoricalColumn(self.sparseRows, index, shared, default, stats)
+            else:
+                codes, stats = column.codes, column.stats
+                if not identity:
+                    codes = array('i', (remap[c] if c >= 0 else -1 for c in codes))
+                    stats.remap(remap)
+                self.featureData[name] = CategoricalColumn(shared, codes, stats)
+
+    #Converts one string value into the typed value stored for an attribute
+    def convertValue(self, name: str, value: str):
+        converters = self._converters or self._compileConverters()
+        return converters[self.attributeNames.index(name)](value)
+
+    #Converts a row of strings into the typed values stored for each attribute
+    def convertRow(self, values: List[str]) -> List:
+        return [convert(value) for convert, value in zip(self._converters or self._compileConverters(), values)]
+
+    #Converts a sparse row (attribute index -> string) into a full row of typed values, defaults is the
+    #list of what each attribute reads as when left out (defaults().values() when not given)
+    def convertSparseRow(self, entries: Dict[int, str], defaults: Optional[List] = None) -> List:
+        converters = self._converters or self._compileConverters()
+        row = list(self.defaults().values()) if defaults is None else list(defaults)
+        for index, value in entries.items():
+            row[index] = converters[index](value)
+        return row
+
+    #Builds one function per column that converts a raw string into its typed value (float or None for
+    #numeric columns, the stripped string otherwise), the streaming counterpart of _compileDecoders
+    def _compileConverters(self) -> tuple:
+        self._converters = tuple(_numericConverter(name) if 'numeric' in self.attributes[name] else str.strip
+                                 for name in self.attributeNames)
+        return self._converters
+
+    #Builds one function per column that converts a block of raw string values and appends them, so adding
+    #rows does no type checks per value. Done once per schema, and again whenever the columns change
+    def _compileDecoders(self) -> tuple:
+        decoders = []
+        for name in self.attributeNames:
+            column = self.featureData[name]
+            if isinstance(column, NumericColumn):
+                decoders.append(_numericDecoder(name, column))
+            else:
+                decoders.append(_categoricalDecoder(column))
+        self._decoders = tuple(decoders)
+        return self._decoders
+
+    #Adds a row of data values (the raw strings of a line, surrounding whitespace is fine)
+    def addDataToRow(self, values: List[str]):
+        if self.sparseRows is not None:
+            self.addSparseRow(dict(enumerate(values)))
+            return
+        for decode, value in zip(self._decoders or self._compileDecoders(), values):
+            decode((value,))
+
+    #Adds every row of an iterable (rows as addRow takes them) and gives back how many there were
+    #Dense rows are decoded ROW_BLOCK at a time, a column at a time
+    def addRows(self, rows) -> int:
+        rows = iter(rows)
+        added = 0
+        block = list(islice(rows, ROW_BLOCK))
+        while block:
+            added += len(block)
+            if self.sparseRows is not None or dict in map(type, block):
+                for values in block:
+                    self.addRow(values)
+            else:
+                for decode, values in zip(self._decoders or self._compileDecoders(), zip(*block)):
+                    decode(values)
+            block = list(islice(rows, ROW_BLOCK))
+        return added
+
+    #Adds a row as it comes from the reader, a list of strings or a sparse attribute index -> string dict
+    def addRow(self, values):
+        if isinstance(values, dict):
+            self.addSparseRow(values)
+        else:
+            self.addDataToRow(values)
+
+    #Adds a sparse row given as attribute index -> string value
+    def addSparseRow(self, entries: Dict[int, str]):
+        #dense storage just fills in the defaults for everything that was left out
+        if self.sparseRows is None:
+            values = []
+            for name, default in self.defaults().items():
+                values.append('?' if default is None else str(default))
+            for index, value in entries.items():
+                values[index] = value
+            self.addDataToRow(values)
+            return
+
+        stored = []
+        converters = self._converters or self._compileConverters()
+        for index in sorted(entries):
+            column = self.featureData[self.attributeNames[index]]
+            if isinstance(column, SparseNumericColumn):
+                value = converters[index](entries[index])
+                if value is None:
+                    value = math.nan
+                    column.storedStats.addMissing()
+                elif value != column.default:
+                    column.storedStats.add(value)
+            else:
+                value = column.dictionary.encode(entries[index].strip())
+                if value != column.default:
+                    column.storedStats.add(value)
+            #only values that differ from the default are stored
+            if value != column.default:
+                stored.append((index, value))
+        self.sparseRows.addRow(stored)
+
+    #Turns the running stats every column keeps into numericStats and discreteValues
+    #(no pass over the data, the stats were updated as rows were added)
+    def calcStats(self):
+        self.numericStats = {}
+        for name in self.attributeNames:
+            column = self.featureData[name]
+            stats = column.stats
+            if name not in self.dictionaries:
+                if stats.count:
+                    self.numericStats[name] = stats.summary()
+            #For discrete attributes that weren't previously defined
+            elif '{' not in self.attributes[name]:
+                self.discreteValues[name] = {column.dictionary.decode(c) for c in stats.seenCodes()}
+
+    def getFeatureType(self, attributeName):
+        if attributeName in self.attributes:
+            if 'numeric' in self.attributes[attributeName]:
+                return 'numeric'
+            else:
+                return 'discrete'
+        return None
+
+    #Number of rows stored
+    def rowCount(self) -> int:
+        if self.sparseRows is not None:
+            return len(self.sparseRows)
+        if not self.featureData:
+            return 0
+        return len(next(iter(self.featureData.values())))
+
+    #Adds the rows of another Data with the same attributes (e.g. a chunk parsed elsewhere) after ours,
+    #merging its running stats into ours instead of working them out again
+    def appendData(self, other: 'Data'):
+        #codes of the other Data's dictionaries that mean something else in ours
+        remaps = {}
+        for index, name in enumerate(self.attributeNames):
+            dictionary = self.dictionaries.get(name)
+            if dictionary is None or other.dictionaries[name] is dictionary:
+                continue
+            remap = [dictionary.encode(value) for value in other.dictionaries[name].values]
+            if remap != list(range(len(remap))):
+                remaps[index] = remap
+
+        if self.sparseRows is not None:
+            rows, otherRows = self.sparseRows, other.sparseRows
+            base = len(rows.indices)
+            rows.rowStarts.extend(base + start for start in otherRows.rowStarts[1:])
+            rows.indices.extend(otherRows.indices)
+            if remaps:
+                rows.values.extend(float(remaps[index][int(value)]) if index in remaps else value
+                                   for index, value in zip(otherRows.indices, otherRows.values))
+            else:
+                rows.values.extend(otherRows.values)
+        else:
+            for index, name in enumerate(self.attributeNames):
+                column, otherColumn = self.featureData[name], other.featureData[name]
+                if isinstance(column, NumericColumn):
+                    column.values.extend(otherColumn.values)
+                    column.missing.extend(otherColumn.missing)
+                elif index in remaps:
+                    remap = remaps[index]
+                    column.codes.extend(remap[c] if c >= 0 else -1 for c in otherColumn.codes)
+                else:
+                    column.codes.extend(otherColumn.codes)
+
+        #the running stats merge directly, so the combined stats need no pass over the rows
+        for index, name in enumerate(self.attributeNames):
+            column, otherColumn = self.featureData[name], other.featureData[name]
+            if self.sparseRows is not None:
+                stats, otherStats = column.storedStats, otherColumn.storedStats
+            else:
+                stats, otherStats = column.stats, otherColumn.stats
+            if name in self.dictionaries:
+                stats.merge(otherStats, remaps.get(index))
+            else:
+                stats.merge(otherStats)
+        self.calcStats()
+
+    #Makes an empty Data with the same attributes and dictionaries (used for chunks)
+    def emptyCopy(self) -> 'Data':
+        copy = Data()
+        copy.sketchSize = self.sketchSize
+        for name, attributeType in self.attributes.items():
+            copy.addAtributes(name, attributeType, self.dictionaries.get(name))
+        if self.sparseRows is not None:
+            copy.makeSparse()
+        return copy
+
+    #Yields each stored row as an attribute name -> value dictionary
+    #Sparse rows come back as SparseInstance objects that only hold the non-default values
+    def instances(self) -> Iterator[Dict]:
+        names = self.attributeNames
+        if self.sparseRows is not None:
+            defaults = self.defaults()
+            decoders = [column.dictionary.decode if isinstance(column, SparseCategoricalColumn) else None
+                        for column in (self.featureData[name] for name in names)]
+            for i in range(len(self.sparseRows)):
+                entries = {}
+                for index, value in self.sparseRows.row(i):
+                    decode = decoders[index]
+                    if decode is not None:
+                        entries[names[index]] = decode(int(value))
+                    else:
+                        entries[names[index]] = None if math.isnan(value) else value
+                yield SparseInstance(entries, defaults)
+            return
+
+        columns = [self.featureData[name] for name in names]
+        for row in zip(*columns):
+            yield dict(zip(names, row))
+
+
+#Size of the reads made from (compressed) input
+READ_BUFFER = 1 << 20
+
+#Magic bytes at the start of each compressed format we can read, and how to open it
+COMPRESSIONS = {
+    'gzip': (b'\x1f\x8b', gzip.open),
+    'bz2': (b'BZh', bz2.open),
+    'xz': (b'\xfd7zXZ\x00', lzma.open),
+}
+
+
+#Which compression a file's first bytes belong to, None for plain text
+def compressionOf(magic: bytes) -> Optional[str]:
+    for name, (prefix, _) in COMPRESSIONS.items():
+        if magic.startswith(prefix):
+            return name
+    return None
+
+
+#Which compression a file on disk uses, None for plain text
+def fileCompression(filename: str) -> Optional[str]:
+    with open(filename, 'rb') as f:
+        return compressionOf(f.read(6))
+
+
+#Gives back the bytes that were read to check the magic number, then the rest of the file object
+#(so any object with read() works, seekable or not). Closing it leaves the file object open
+class _PrefixedReader(io.RawIOBase):
+    def __init__(self, prefix: bytes, source):
+        self._prefix = prefix
+        self._source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            data, self._prefix = self._prefix[:len(buffer)], self._prefix[len(buffer):]
+        else:
+            data = self._source.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+#Opens a path or binary file object as text, decompressing it on the fly if it starts with the
+#magic bytes of gzip, bz2 or xz. A file object that is passed in is not closed with the text
+def openArff(source) -> io.TextIOWrapper:
+    if isinstance(source, (str, os.PathLike)):
+        compression = fileCompression(source)
+        if compression is None:
+            return open(source, 'r', encoding='utf-8', buffering=READ_BUFFER)
+        binary = COMPRESSIONS[compression][1](source, 'rb')
+    else:
+        magic = source.read(6)
+        binary = io.BufferedReader(_PrefixedReader(magic, source), READ_BUFFER)
+        compression = compressionOf(magic)
+        if compression is not None:
+            binary = COMPRESSIONS[compression][1](binary, 'rb')
+    if compression is not None:
+        #the decompressor is asked for large blocks instead of a line at a time
+        binary = io.BufferedReader(binary, READ_BUFFER)
+    return io.TextIOWrapper(binary, encoding='utf-8')
+
+
+#Reads the header of an .arff file up front, then parses the @data section on demand
+#Rows written in sparse format ({3 1.0, 17 red}) are read too. With sparse=None the storage follows
+#the first data row, sparse=True/False forces it either way
+#filename can be a path or a binary file object, compressed or not (see openArff)
+class ArffStream:
+    def __init__(self, filename, reference: Optional[Data] = None, sparse: Optional[bool] = None):
+        self.filename = filename
+        #Only holds the attributes until rows are pulled from the stream
+        self.header = Data()
+        self._file = openArff(filename)
+        try:
+            self._readHeader()
+            self._pending = self._nextLine()
+        except Exception:
+            self._file.close()
+            raise
+        if sparse is None:
+            sparse = self._pending is not None and self._pending.startswith('{')
+        if sparse:
+            self.header.makeSparse()
+        if reference is not None:
+            self.header.shareDictionaries(reference)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    #Goes through lines until the @data line, leaving the file positioned on the first row
+    def _readHeader(self):
+        for line in self._file:
+
+            #removes comments and removes tailing whitespaces
+            line = stripComment(line)
+
+            #incase of empty lines keep going
+            if not line:
+                continue
+
+            # Look for attributes and what they are
+            if line.lower().startswith('@attribute'):
+                match = re.match(r'@attribute\s+\'?([^\']+)\'?\s+([^\s].*)', line, re.IGNORECASE)
+                if match:
+                    attributeName, attributeType = match.groups()
+                    self.header.addAtributes(attributeName.strip(), attributeType.strip())
+
+            # Looks for data section
+            elif line.lower().startswith('@data'):
+                return
+
+    #Gives back the next data line without comments, or None at the end of the file
+    def _nextLine(self) -> Optional[str]:
+        for line in self._file:
+            line = stripComment(line)
+            if line:
+                return line
+        return None
+
+    #Yields each data line split into its string values, sparse lines as attribute index -> value
+    def _rawRows(self) -> Iterator:
+        attributeCount = len(self.header.attributes)
+        line = self._pending
+        self._pending = None
+        if line is None:
+            return
+        values = parseLine(line, attributeCount)
+        if values is not None:
+            yield values
+        for line in self._file:
+            #plain lines (no comment, quotes or sparse braces) just get split on commas
+            if '%' in line or '{' in line or "'" in line or '"' in line:
+                line = stripComment(line)
+                values = parseLine(line, attributeCount) if line else None
+            else:
+                line = line.rstrip()
+                values = line.split(',') if line else None
+                if values is not None and len(values) != attributeCount:
+                    values = None
+            if values is not None:
+                yield values
+
+    #Yields each row as a list of typed values
+    def rows(self) -> Iterator[List]:
+        defaults = list(self.header.defaults().values())
+        for values in self._rawRows():
+            if isinstance(values, dict):
+                yield self.header.convertSparseRow(values, defaults)
+            else:
+                yield self.header.convertRow(values)
+
+    #Yields each row as an attribute name -> value dictionary, sparse rows as SparseInstance objects
+    def instances(self) -> Iterator[Dict]:
+        names = self.header.attributeNames
+        converters = self.header._compileConverters()
+        defaults = self.header.defaults()
+        for values in self._rawRows():
+            if isinstance(values, dict):
+                yield SparseInstance({names[i]: converters[i](v) for i, v in values.items()}, defaults)
+            else:
+                yield {name: convert(value) for name, convert, value in zip(names, converters, values)}
+
+    #Yields Data objects holding at most chunkSize rows each, with their own stats
+    def chunks(self, chunkSize: int = 10000) -> Iterator[Data]:
+        if chunkSize < 1:
+            raise ValueError("chunkSize must be at least 1")
+        rows = self._rawRows()
+        while True:
+            chunk = self.header.emptyCopy()
+            if not chunk.addRows(islice(rows, chunkSize)):
+                return
+            chunk.calcStats()
+            yield chunk
+
+
+#Removes a % comment (outside of quotes) and surrounding whitespace from a line
+def stripComment(line: str) -> str:
+    if '%' in line:
+        if "'" in line or '"' in line:
+            quote = None
+            for position, char in enumerate(line):
+                if quote:
+                    if char == quote:
+                        quote = None
+                elif char in '\'"':
+                    quote = char
+                elif char == '%':
+                    line = line[:position]
+                    break
+        else:
+            line = line[:line.index('%')]
+    return line.strip()
+
+
+#Splits a line on the commas that are outside of quotes, taking the quotes off quoted values
+def splitQuoted(line: str) -> List[str]:
+    values = []
+    field = ''
+    quoted = None  # text between the quotes, None if the value isn't quoted
+    quote = None  # the quote character while inside quotes
+    for char in line:
+        if quote:
+            if char == quote:
+                quote = None
+            else:
+                quoted += char
+        elif char in '\'"' and quoted is None and not field.strip():
+            quote = char
+            quoted = ''
+        elif char == ',':
+            values.append(field.strip() if quoted is None else quoted)
+            field = ''
+            quoted = None
+        else:
+            field += char
+    values.append(field.strip() if quoted is None else quoted)
+    return values
+
+
+#Splits a data line (already stripped of comments) into its values, None if the row should be skipped
+#Values are left unstripped unless the line has quotes, the decoders deal with the whitespace
+def parseLine(line: str, attributeCount: int):
+    if line.startswith('{'):
+        return parseSparseLine(line, attributeCount)
+    values = splitQuoted(line) if "'" in line or '"' in line else line.split(',')
+
+    #So long as values is the same length on attributes give back the row
+    if len(values) == attributeCount:
+        return values
+    return None
+
+
+#Splits a sparse line like {3 1.0, 17 red} into attribute index -> value, None if it is malformed
+def parseSparseLine(line: str, attributeCount: int) -> Optional[Dict[int, str]]:
+    entries = {}
+    body = line[1:line.find('}')] if '}' in line else None
+    if body is None:
+        return None
+    for item in body.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(None, 1)
+        if len(parts) != 2 or not parts[0].isdigit():
+            return None
+        index = int(parts[0])
+        if index >= attributeCount:
+            return None
+        entries[index] = parts[1].strip()
+    return entries
+
+
+#Binary cache written next to an .arff file: magic, header length, json header, then raw column buffers
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'ARFFC001'
+
+
+def cachePath(filename: str) -> str:
+    return os.fspath(filename) + CACHE_SUFFIX
+
+
+#sha256 of a file's contents, read in large blocks
+def fileHash(filename: str) -> str:
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+#Writes arffData as a binary cache for filename, replacing any old cache in one step
+def saveCache(arffData: Data, filename: str):
+    stat = os.stat(filename)
+    buffers = []
+    offset = 0
+
+    #Adds the raw buffers of one column (or of the sparse rows) and notes where each one starts
+    def addBuffers(entry, parts):
+        nonlocal offset
+        for part, raw in parts.items():
+            entry[part] = [offset, len(raw)]
+            padding = -len(raw) % 8
+            buffers.append(raw + b'\0' * padding)
+            offset += len(raw) + padding
+        return entry
+
+    columns = []
+    sparse = None
+    if arffData.sparseRows is not None:
+        rows = arffData.sparseRows
+        sparse = addBuffers({}, {'rowStarts': bytes(rows.rowStarts), 'indices': bytes(rows.indices),
+                                 'values': bytes(rows.values)})
+    else:
+        for name in arffData.attributes:
+            column = arffData.featureData[name]
+            if isinstance(column, NumericColumn):
+                parts = {'values': bytes(column.values), 'missing': bytes(column.missing)}
+            else:
+                parts = {'codes': bytes(column.codes)}
+            columns.append(addBuffers({'name': name}, parts))
+
+    header = {
+        'source': {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': fileHash(filename)},
+        'byteorder': sys.byteorder,
+        'itemsize': {'d': array('d').itemsize, 'i': array('i').itemsize, 'q': array('q').itemsize},
+        'rows': arffData.rowCount(),
+        'attributes': list(arffData.attributes.items()),
+        'dictionaries': {name: d.values for name, d in arffData.dictionaries.items()},
+        'sketchSize': arffData.sketchSize,
+        #the running stats of the stored entries (for dense columns that is every entry)
+        'stats': {name: (column.storedStats if arffData.sparseRows is not None else column.stats).toDict()
+                  for name, column in arffData.featureData.items()},
+        'columns': columns,
+        'sparse': sparse,
+    }
+    #padding keeps the buffers (counted from the end of the header) 8-byte aligned
+    rawHeader = json.dumps(header).encode('utf-8')
+    rawHeader += b' ' * (-len(rawHeader) % 8)
+
+    path = cachePath(filename)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'wb') as f:
+        f.write(CACHE_MAGIC)
+        f.write(len(rawHeader).to_bytes(8, 'little'))
+        f.write(rawHeader)
+        for raw in buffers:
+            f.write(raw)
+    os.replace(temp, path)
+
+
+#Memory-maps the cache for filename and returns a Data over it, or None if there is no usable cache
+#sparse is arffFile's: a cache stored the other way than the one asked for is not usable either
+def loadCache(filename: str, sparse: Optional[bool] = None) -> Optional[Data]:
+    path = cachePath(filename)
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    #a header from another version (missing or renamed keys, other types) is treated as stale
+    try:
+        arffData = _readCache(mapped, filename, sparse)
+    except (KeyError, IndexError, TypeError, ValueError):
+        arffData = None
+    if arffData is None:
+        mapped.close()
+    return arffData
+
+
+#Builds the Data over a mapped cache, None if the cache is stale
+def _readCache(mapped: mmap.mmap, filename: str, sparse: Optional[bool]) -> Optional[Data]:
+    if mapped[:len(CACHE_MAGIC)] != CACHE_MAGIC:
+        return None
+    headerLength = int.from_bytes(mapped[len(CACHE_MAGIC):len(CACHE_MAGIC) + 8], 'little')
+    start = len(CACHE_MAGIC) + 8 + headerLength
+    header = json.loads(mapped[len(CACHE_MAGIC) + 8:start].decode('utf-8'))
+    if header['byteorder'] != sys.byteorder or header['itemsize'] != {'d': array('d').itemsize, 'i': array('i').itemsize, 'q': array('q').itemsize}:
+        return None
+    if sparse is not None and (header['sparse'] is not None) != sparse:
+        return None
+
+    #A changed size or mtime only means stale if the contents changed too
+    stat = os.stat(filename)
+    source = header['source']
+    if (stat.st_size, stat.st_mtime_ns) != (source['size'], source['mtime']):
+        if stat.st_size != source['size'] or fileHash(filename) != source['sha256']:
+            return None
+
+    arffData = Data()
+    for name, attributeType in header['attributes']:
+        dictionary = None
+        if name in header['dictionaries']:
+            dictionary = CategoryDictionary(header['dictionaries'][name])
+        arffData.addAtributes(name, attributeType, dictionary)
+
+    #the columns are views straight into the mapped file, so processes share the same pages
+    #the Data keeps the map and the views so close() can release them
+    view = memoryview(mapped)
+    views = []
+
+    def buffer(location, typecode):
+        offset, length = location
+        if offset < 0 or length < 0 or start + offset + length > len(mapped):
+            raise ValueError("Cache buffer out of range")
+        cast = view[start + offset:start + offset + length].cast(typecode)
+        views.append(cast)
+        return cast
+
+    try:
+        if header['sparse'] is not None:
+            sparseLocations = header['sparse']
+            arffData.makeSparse(SparseRows(buffer(sparseLocations['rowStarts'], 'q'),
+                                           buffer(sparseLocations['indices'], 'i'),
+                                           buffer(sparseLocations['values'], 'd')))
+        for entry in header['columns']:
+            name = entry['name']
+            if 'values' in entry:
+                arffData.featureData[name] = NumericColumn(buffer(entry['values'], 'd'),
+                                                           buffer(entry['missing'], 'B'))
+            else:
+                arffData.featureData[name] = CategoricalColumn(arffData.dictionaries[name],
+                                                               buffer(entry['codes'], 'i'))
+
+        for name, state in header['stats'].items():
+            column = arffData.featureData[name]
+            stats = CategoricalStats.fromDict(state) if name in arffData.dictionaries else NumericStats.fromDict(state)
+            if arffData.sparseRows is not None:
+                column.storedStats = stats
+            else:
+                column.stats = stats
+        arffData.sketchSize = header['sketchSize']
+        arffData.calcStats()
+    #the views have to be let go of before the map can be closed
+    except (KeyError, IndexError, TypeError, ValueError):
+        for cast in views:
+            cast.release()
+        view.release()
+        raise
+    arffData._cacheMap = (mapped, views + [view])
+    return arffData
+
+
+#Byte offset where the rows after @data start
+def dataOffset(filename: str) -> int:
+    offset = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            offset += len(line)
+            if line.split(b'%')[0].strip().lower().startswith(b'@data'):
+                break
+    return offset
+
+
+#Splits the bytes from start to the end of the file into about `count` ranges that each end on a newline
+def splitRanges(filename: str, start: int, count: int):
+    size = os.path.getsize(filename)
+    step = max(1, (size - start) // max(1, count))
+    ranges = []
+    with open(filename, 'rb') as f:
+        while start < size:
+            f.seek(min(size, start + step))
+            f.readline()
+            end = min(size, f.tell())
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+#Parses the rows in one byte range of a file into a Data with its own dictionaries and stats
+#(runs in a worker process, so it only gets plain arguments)
+def parseRange(filename: str, start: int, end: int, attributes: List, sparse: bool, sketchSize: int = 0) -> Data:
+    chunk = Data()
+    chunk.sketchSize = sketchSize
+    for name, attributeType in attributes:
+        chunk.addAtributes(name, attributeType)
+    if sparse:
+        chunk.makeSparse()
+
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode('utf-8')
+    attributeCount = len(attributes)
+    lines = (stripComment(line) for line in text.splitlines())
+    rows = (parseLine(line, attributeCount) for line in lines if line)
+    chunk.addRows(values for values in rows if values is not None)
+
+    chunk.calcStats()
+    return chunk
+
+
+#Largest byte range one worker parses at a time
+PARALLEL_CHUNK_BYTES = 64 << 20
+
+
+#Parses the @data section with a pool of worker processes and stitches the chunks together in file order
+def parallelArffFile(filename: str, workers: int, reference: Optional[Data] = None,
+                     sparse: Optional[bool] = None, sketchSize: int = 0) -> Data:
+    with ArffStream(filename, reference, sparse) as stream:
+        arffData = stream.header
+    if sketchSize:
+        arffData.trackQuantiles(sketchSize)
+    attributes = list(arffData.attributes.items())
+
+    #a few chunks per worker keeps them all busy, but no chunk gets bigger than PARALLEL_CHUNK_BYTES
+    start = dataOffset(filename)
+    count = max(workers * 4, (os.path.getsize(filename) - start) // PARALLEL_CHUNK_BYTES + 1)
+    ranges = splitRanges(filename, start, count)
+
+    if not ranges:
+        return arffData
+    starts, ends = zip(*ranges)
+    count = len(ranges)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        #map hands the chunks back in file order while later ones are still being parsed
+        chunks = pool.map(parseRange, [filename] * count, starts, ends, [attributes] * count,
+                          [arffData.isSparse()] * count, [sketchSize] * count)
+        for chunk in chunks:
+            arffData.appendData(chunk)
+    return arffData
+
+
+#Look through an .arff file and return arffData object
+#Pass the training Data as reference when loading a test file so both use the same category codes
+#With cache=True a binary copy is kept next to the file and memory-mapped on later loads
+#sparse=None keeps sparse files sparse in memory, True/False forces sparse or dense storage
+#workers > 1 parses the rows in that many processes (see parallelArffFile)
+#sketchSize > 0 keeps a quantile sketch of that size with the stats of every numeric column
+#filename can also be a binary file object, and gzip, bz2 or xz input is decompressed while it is read.
+#Those are read by one process, and file objects are never cached
+def arffFile(filename, reference: Optional[Data] = None, cache: bool = False,
+             sparse: Optional[bool] = None, workers: int = 1, sketchSize: int = 0) -> Data:
+    isPath = isinstance(filename, (str, os.PathLike))
+    cache = cache and isPath
+    if cache:
+        arffData = loadCache(filename, sparse)
+        #a cache written without the requested sketches is no use, its mmap is closed before the file is
+        #parsed again so the cache can be rewritten below
+        if arffData is not None and arffData.sketchSize == sketchSize:
+            if reference is not None:
+                arffData.shareDictionaries(reference)
+            return arffData
+        if arffData is not None:
+            arffData.close()
+
+    #byte ranges only line up with rows in an uncompressed file
+    if workers > 1 and isPath and fileCompression(filename) is None:
+        arffData = parallelArffFile(filename, workers, reference, sparse, sketchSize)
+    else:
+        with ArffStream(filename, reference, sparse) as stream:
+            arffData = stream.header
+            if sketchSize:
+                arffData.trackQuantiles(sketchSize)
+            arffData.addRows(stream._rawRows())
+
+        #Fill in numericStats and discreteValues from the stats kept while reading
+        arffData.calcStats()
+
+    if cache:
+        #a missing cache only costs speed, so a read-only folder is not an error
+        try:
+            saveCache(arffData, filename)
+        except OSError:
+            pass
+    return arffData
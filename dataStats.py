@@ -0,0 +1,275 @@
+"""
+Name: Rowan Noel-Rickert
+
+Running statistics that Data keeps up to date while rows are added, so no second pass over a column
+is needed once a file is read.  Every kind of stats can be merged with another of the same kind,
+which is how chunks parsed separately (or in other processes) are combined.
+"""
+import math
+from itertools import repeat
+from operator import mul, sub
+from typing import Dict, List, Optional
+
+
+#Mergeable streaming quantile sketch (KLL style): values at level i stand for 2**i original values.
+#When a level fills up it is sorted and every other value moves up a level, so memory stays
+#around k * log(n / k) values no matter how many are added
+class QuantileSketch:
+    def __init__(self, k: int = 200):
+        self.k = k
+        self.count = 0
+        self.levels: List[List[float]] = [[]]
+        #alternates which half survives a compaction so the error doesn't lean one way
+        self._offset = 0
+
+    def add(self, value: float):
+        self.levels[0].append(value)
+        self.count += 1
+        if len(self.levels[0]) >= self.k:
+            self._compact()
+
+    #Adds a value with weight `times`, one copy per set bit of times at the matching level
+    def addRepeated(self, value: float, times: int):
+        level = 0
+        while times >> level:
+            if (times >> level) & 1:
+                while level >= len(self.levels):
+                    self.levels.append([])
+                self.levels[level].append(value)
+            level += 1
+        self.count += times
+        self._compact()
+
+    def merge(self, other: 'QuantileSketch'):
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append([])
+            self.levels[level].extend(values)
+        self.count += other.count
+        self._compact()
+
+    #Pushes every full level up one level
+    def _compact(self):
+        level = 0
+        while level < len(self.levels):
+            values = self.levels[level]
+            if len(values) >= self.k:
+                values.sort()
+                #an odd value out stays behind so no weight is lost
+                keep = [values.pop()] if len(values) % 2 else []
+                if level + 1 == len(self.levels):
+                    self.levels.append([])
+                self.levels[level + 1].extend(values[self._offset::2])
+                self._offset ^= 1
+                self.levels[level] = keep
+            level += 1
+
+    #Gives back the approximate value at each fraction q (0 to 1) of the data
+    def quantiles(self, fractions: List[float]) -> List[Optional[float]]:
+        weighted = sorted((value, 1 << level) for level, values in enumerate(self.levels) for value in values)
+        if not weighted:
+            return [None for _ in fractions]
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for q in fractions:
+            target = q * total
+            running = 0
+            result = weighted[-1][0]
+            for value, weight in weighted:
+                running += weight
+                if running >= target:
+                    result = value
+                    break
+            results.append(result)
+        return results
+
+    def toDict(self) -> Dict:
+        return {'k': self.k, 'count': self.count, 'levels': self.levels, 'offset': self._offset}
+
+    @classmethod
+    def fromDict(cls, state: Dict) -> 'QuantileSketch':
+        sketch = cls(state['k'])
+        sketch.count = state['count']
+        sketch.levels = [list(values) for values in state['levels']]
+        sketch._offset = state['offset']
+        return sketch
+
+
+#Count, missing count, min, max, mean and variance (Welford) of a numeric column, plus an optional sketch
+class NumericStats:
+    def __init__(self, sketchSize: int = 0):
+        self.count = 0
+        self.missing = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.sketch = QuantileSketch(sketchSize) if sketchSize else None
+
+    def add(self, value: float):
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if self.sketch is not None:
+            self.sketch.add(value)
+
+    def addMissing(self):
+        self.missing += 1
+
+    #Adds a block of values at once, their stats are worked out together and merged in
+    def addBlock(self, values):
+        if not values:
+            return
+        block = NumericStats()
+        block.count = len(values)
+        block.min, block.max = min(values), max(values)
+        block.mean = sum(values) / block.count
+        deviations = list(map(sub, values, repeat(block.mean, block.count)))
+        block.m2 = sum(map(mul, deviations, deviations))
+        self.merge(block)
+        if self.sketch is not None:
+            for value in values:
+                self.sketch.add(value)
+
+    #Adds the same value `times` times at once (used for the left out entries of sparse columns)
+    def addRepeated(self, value: float, times: int):
+        if times <= 0:
+            return
+        block = NumericStats()
+        block.count, block.min, block.max, block.mean = times, value, value, value
+        self.merge(block)
+        if self.sketch is not None:
+            self.sketch.addRepeated(value, times)
+
+    #Combines two sets of stats (Chan et al. parallel variance)
+    def merge(self, other: 'NumericStats'):
+        self.missing += other.missing
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if other.sketch is not None:
+            if self.sketch is None:
+                self.sketch = QuantileSketch(other.sketch.k)
+            self.sketch.merge(other.sketch)
+
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count else 0.0
+
+    def copy(self) -> 'NumericStats':
+        return NumericStats.fromDict(self.toDict())
+
+    #The summary Data keeps in numericStats
+    def summary(self) -> Dict[str, float]:
+        return {'min': self.min, 'max': self.max, 'count': self.count, 'missing': self.missing,
+                'mean': self.mean, 'variance': self.variance()}
+
+    def toDict(self) -> Dict:
+        state = {'count': self.count, 'missing': self.missing, 'min': self.min, 'max': self.max,
+                 'mean': self.mean, 'm2': self.m2}
+        if self.sketch is not None:
+            state['sketch'] = self.sketch.toDict()
+        return state
+
+    @classmethod
+    def fromDict(cls, state: Dict) -> 'NumericStats':
+        stats = cls()
+        stats.count, stats.missing = state['count'], state['missing']
+        stats.min, stats.max = state['min'], state['max']
+        stats.mean, stats.m2 = state['mean'], state['m2']
+        if 'sketch' in state:
+            stats.sketch = QuantileSketch.fromDict(state['sketch'])
+        return stats
+
+
+#How many times each category code appears in a categorical column, plus the missing count
+class CategoricalStats:
+    def __init__(self):
+        self.counts: List[int] = []  # code -> count
+        self.missing = 0
+
+    def add(self, code: int):
+        if code < 0:
+            self.missing += 1
+            return
+        counts = self.counts
+        if code >= len(counts):
+            counts.extend([0] * (code + 1 - len(counts)))
+        counts[code] += 1
+
+    def addRepeated(self, code: int, times: int):
+        if times <= 0:
+            return
+        if code < 0:
+            self.missing += times
+            return
+        self.add(code)
+        self.counts[code] += times - 1
+
+    #Combines another column's counts, remap turns the other column's codes into ours
+    def merge(self, other: 'CategoricalStats', remap: Optional[List[int]] = None):
+        self.missing += other.missing
+        for code, count in enumerate(other.counts):
+            if count:
+                self.addRepeated(remap[code] if remap is not None else code, count)
+
+    #Moves the counts over to new codes (after the column's dictionary has been swapped)
+    def remap(self, remap: List[int]):
+        counts, self.counts = self.counts, []
+        for code, count in enumerate(counts):
+            if count:
+                self.addRepeated(remap[code], count)
+
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def copy(self) -> 'CategoricalStats':
+        return CategoricalStats.fromDict(self.toDict())
+
+    #Codes that appear at least once
+    def seenCodes(self) -> List[int]:
+        return [code for code, count in enumerate(self.counts) if count]
+
+    def toDict(self) -> Dict:
+        return {'counts': self.counts, 'missing': self.missing}
+
+    @classmethod
+    def fromDict(cls, state: Dict) -> 'CategoricalStats':
+        stats = cls()
+        stats.counts = list(state['counts'])
+        stats.missing = state['missing']
+        return stats
+
+
+#Entropy of a list of class counts
+def countsEntropy(counts: List[int]) -> float:
+    total = sum(counts)
+    entropy = 0.0
+    for count in counts:
+        if count:
+            prob = count / total
+            entropy -= prob * math.log2(prob)
+    return entropy
+
+
+#Information gain of splitting rows with these class counts by an attribute whose value -> class counts
+#table is given (rows missing the attribute belong in the table too, under their own key)
+def countsGain(classCounts: Dict, table: Dict) -> float:
+    total = sum(classCounts.values())
+    # Calculates weighted entropy after split
+    weightedEntropy = 0
+    for valueCounts in table.values():
+        counts = list(valueCounts.values())
+        weight = sum(counts) / total
+        weightedEntropy += weight * countsEntropy(counts)
+    return countsEntropy(list(classCounts.values())) - weightedEntropy
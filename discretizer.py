@@ -0,0 +1,189 @@
+"""
+Name: Rowan Noel-Rickert
+
+Turns the numeric attributes of a Data into discrete bins so ID3 and Naive Bayes can use files like
+lakesFold1.arff directly.  fit() learns the cut points from the training Data, transform() gives back
+a new Data where every binned attribute is categorical, and the same fitted Discretizer transforms the
+test Data so both end up with the same bins (and the same category codes).
+
+    width      equal-width bins between the min and max of the column
+    frequency  bins holding about the same number of rows, from a streaming quantile sketch
+    entropy    cut points chosen by information gain on the target (Fayyad & Irani, MDL stopping rule)
+"""
+import math
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+from arffReader import CategoricalColumn, CategoryDictionary, Data, NumericColumn
+from dataStats import CategoricalStats, QuantileSketch, countsEntropy
+
+METHODS = ('width', 'frequency', 'entropy')
+
+
+class Discretizer:
+    # bins is the number of bins for width and frequency, entropy picks its own number of bins
+    # attributes limits which numeric attributes get binned, by default all of them
+    def __init__(self, method: str = 'width', bins: int = 5, targetAttribute: Optional[str] = None,
+                 attributes: Optional[List[str]] = None, sketchSize: int = 200):
+        if method not in METHODS:
+            raise ValueError(f"Unknown binning method '{method}', use one of {', '.join(METHODS)}")
+        if method == 'entropy' and targetAttribute is None:
+            raise ValueError("Entropy binning needs a target attribute")
+        if bins < 1:
+            raise ValueError("bins must be at least 1")
+        self.method = method
+        self.bins = bins
+        self.targetAttribute = targetAttribute
+        self.attributes = attributes
+        self.sketchSize = sketchSize
+        # attribute name -> sorted cut points, a value goes in bin bisect_left(cuts, value) so a value equal to
+        # a cut point lands in the bin the cut closes, (lo-cut], like the labels say
+        self.cutPoints: Dict[str, List[float]] = {}
+        # attribute name -> bin label codes, shared by every Data this transforms
+        self.dictionaries: Dict[str, CategoryDictionary] = {}
+
+    # Learns the cut points of every numeric attribute from the training data
+    def fit(self, data: Data) -> 'Discretizer':
+        names = self.attributes
+        if names is None:
+            names = [name for name in data.attributeNames
+                     if data.getFeatureType(name) == 'numeric' and name != self.targetAttribute]
+        self.cutPoints = {}
+        self.dictionaries = {}
+        for name in names:
+            if data.getFeatureType(name) != 'numeric':
+                raise ValueError(f"Attribute '{name}' is not numeric")
+            column = data.featureData[name]
+            if self.method == 'width':
+                cuts = self._widthCuts(column.stats)
+            elif self.method == 'frequency':
+                cuts = self._frequencyCuts(column)
+            else:
+                cuts = self._entropyCuts(column, data.featureData[self.targetAttribute].codes)
+            self.cutPoints[name] = cuts
+            self.dictionaries[name] = CategoryDictionary(binLabels(cuts))
+        return self
+
+    # Gives back a copy of data with every fitted attribute replaced by its bin
+    # Other columns are shared with data, not copied
+    def transform(self, data: Data) -> Data:
+        binned = Data()
+        for name in data.attributeNames:
+            column = data.featureData[name]
+            if name in self.cutPoints:
+                dictionary = self.dictionaries[name]
+                binned.addAtributes(name, '{' + ','.join(dictionary.values) + '}', dictionary)
+                binned.featureData[name] = self._binColumn(name, column)
+                continue
+            binned.addAtributes(name, data.attributes[name], data.dictionaries.get(name))
+            # sparse columns are views over the rows, so they are expanded into plain columns
+            if isinstance(column, NumericColumn) or isinstance(column, CategoricalColumn):
+                binned.featureData[name] = column
+            elif name in data.dictionaries:
+                binned.featureData[name] = CategoricalColumn(column.dictionary, column.codes, column.stats)
+            else:
+                binned.featureData[name] = NumericColumn(column.values, column.missing, column.stats)
+            if name in data.discreteValues:
+                binned.discreteValues[name] = set(data.discreteValues[name])
+        binned.calcStats()
+        return binned
+
+    def fitTransform(self, data: Data) -> Data:
+        return self.fit(data).transform(data)
+
+    # Bins one numeric column in bulk, missing values stay missing (-1)
+    def _binColumn(self, name: str, column) -> CategoricalColumn:
+        cuts = self.cutPoints[name]
+        codes = array('i', (-1 if missing else bisect_left(cuts, value)
+                            for value, missing in zip(column.values, column.missing)))
+        stats = CategoricalStats()
+        for code, count in Counter(codes).items():
+            stats.addRepeated(code, count)
+        return CategoricalColumn(self.dictionaries[name], codes, stats)
+
+    # Equal-width cut points only need the min and max the column already keeps
+    def _widthCuts(self, stats) -> List[float]:
+        if not stats.count or stats.max <= stats.min:
+            return []
+        width = (stats.max - stats.min) / self.bins
+        return [stats.min + width * i for i in range(1, self.bins)]
+
+    # Equal-frequency cut points from a quantile sketch, the column's own if it was loaded with one
+    def _frequencyCuts(self, column) -> List[float]:
+        sketch = column.stats.sketch
+        if sketch is None:
+            sketch = QuantileSketch(self.sketchSize)
+            for value, missing in zip(column.values, column.missing):
+                if not missing:
+                    sketch.add(value)
+        cuts = sketch.quantiles([i / self.bins for i in range(1, self.bins)])
+        # heavily repeated values can give the same cut twice
+        return sorted(set(cut for cut in cuts if cut is not None))
+
+    # Entropy cut points: one pass counts the classes of every distinct value, then the cut points are
+    # found over the sorted distinct values instead of the rows
+    def _entropyCuts(self, column, targetCodes) -> List[float]:
+        classCounts = defaultdict(Counter)
+        for value, missing, targetCode in zip(column.values, column.missing, targetCodes):
+            if not missing and targetCode >= 0:
+                classCounts[value][targetCode] += 1
+        values = sorted(classCounts)
+        if len(values) < 2:
+            return []
+        classes = sorted({code for counts in classCounts.values() for code in counts})
+
+        # prefix[i][c] is how many rows of class c have one of the first i distinct values
+        prefix = [[0] * len(classes)]
+        for value in values:
+            counts = classCounts[value]
+            prefix.append([total + counts[code] for total, code in zip(prefix[-1], classes)])
+
+        cuts = []
+        self._splitRange(values, prefix, 0, len(values), cuts)
+        return sorted(cuts)
+
+    # Finds the best cut between distinct values lo and hi and keeps splitting while MDL accepts it
+    def _splitRange(self, values, prefix, lo: int, hi: int, cuts: List[float]):
+        whole = [high - low for high, low in zip(prefix[hi], prefix[lo])]
+        total = sum(whole)
+        wholeEntropy = countsEntropy(whole)
+        if hi - lo < 2 or wholeEntropy == 0:
+            return
+
+        bestEntropy = math.inf
+        best = None
+        for i in range(lo + 1, hi):
+            left = [middle - low for middle, low in zip(prefix[i], prefix[lo])]
+            right = [count - l for count, l in zip(whole, left)]
+            leftTotal = sum(left)
+            entropy = (leftTotal * countsEntropy(left) + (total - leftTotal) * countsEntropy(right)) / total
+            if entropy < bestEntropy:
+                bestEntropy, best = entropy, (i, left, right)
+
+        i, left, right = best
+        gain = wholeEntropy - bestEntropy
+        k = sum(1 for count in whole if count)
+        k1 = sum(1 for count in left if count)
+        k2 = sum(1 for count in right if count)
+        delta = math.log2(3 ** k - 2) - (k * wholeEntropy - k1 * countsEntropy(left) - k2 * countsEntropy(right))
+        if gain <= (math.log2(total - 1) + delta) / total:
+            return
+        cuts.append((values[i - 1] + values[i]) / 2)
+        self._splitRange(values, prefix, lo, i, cuts)
+        self._splitRange(values, prefix, i, hi, cuts)
+
+
+# Labels for the bins a list of cut points makes, written the way Weka writes them, e.g. (-inf-2.5]
+# The cut points get as many digits as it takes to tell them apart
+def binLabels(cuts: List[float]) -> List[str]:
+    for digits in (6, 10, 17):
+        written = [f"{cut:.{digits}g}" for cut in cuts]
+        if len(set(written)) == len(written):
+            break
+    edges = ['-inf'] + written + ['inf']
+    labels = []
+    for i in range(len(edges) - 1):
+        closing = ')' if i == len(edges) - 2 else ']'
+        labels.append(f"({edges[i]}-{edges[i + 1]}{closing}")
+    return labels
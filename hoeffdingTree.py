@@ -0,0 +1,164 @@
+"""
+Name: Rowan Noel-Rickert
+
+A decision tree that learns from a stream of rows (a Hoeffding tree, Domingos & Hulten's VFDT), for
+data that never fits in memory at once.  The tree is made of the same Nodes as ID3 and picks splits by
+the same information gain, but a leaf only keeps the counts of the rows that reached it.  Every
+gracePeriod rows a leaf checks whether its best attribute beats the second best by more than the
+Hoeffding bound (or the two are too close to matter) and splits on it if so.  Rows are learned once,
+the tree is never retrained, and maxLeaves caps how many leaves (and so how many counts) it can have.
+
+    tree = HoeffdingTree(stream.header, 'types')
+    tree.learnStream(stream)
+"""
+import math
+from typing import Dict, Iterable, List, Optional
+from ID3 import Node
+from dataStats import countsGain
+
+
+# The counts a leaf keeps of the rows that reached it
+class LeafStats:
+    __slots__ = ('attributes', 'classCounts', 'tables', 'sinceCheck')
+
+    def __init__(self, attributes: List[str]):
+        # attributes not used by a split above this leaf
+        self.attributes = attributes
+        # class -> count
+        self.classCounts: Dict[str, int] = {}
+        # attribute -> value -> class -> count, rows missing the attribute count under None
+        self.tables: Dict[str, Dict] = {attr: {} for attr in attributes}
+        # rows seen since the leaf last checked for a split
+        self.sinceCheck = 0
+
+
+class HoeffdingTree:
+    # header is a Data holding the attributes (an ArffStream's header will do), nothing is read from its rows
+    # delta is the chance of picking a different split than the whole stream would, tieThreshold how close
+    # the two best gains can get before the leaf splits on either
+    def __init__(self, header, targetAttribute: str, delta: float = 1e-7, tieThreshold: float = 0.05,
+                 gracePeriod: int = 200, maxLeaves: int = 1000):
+        for attr in header.attributes:
+            if header.getFeatureType(attr) == 'numeric':
+                raise ValueError(f"Numerical attribute '{attr}' found. This only supports discrete attributes "
+                                 f"(bin them first with discretizer.Discretizer).")
+        self.header = header
+        self.targetAttribute = targetAttribute
+        self.delta = delta
+        self.tieThreshold = tieThreshold
+        self.gracePeriod = gracePeriod
+        self.maxLeaves = maxLeaves
+        # in declaration order so ties between equally good splits always go the same way
+        self.attributes = [attr for attr in header.attributes if attr != targetAttribute]
+        # information gain is at most log2 of the number of classes
+        self.gainRange = math.log2(max(2, len(header.dictionaries[targetAttribute])))
+        self.root = Node(isLeaf=True)
+        # id of each leaf Node -> its counts
+        self.stats: Dict[int, LeafStats] = {id(self.root): LeafStats(self.attributes)}
+        # id of each split Node -> the attributes its children can still split on
+        self.splitAttributes: Dict[int, List[str]] = {}
+        self.rowsSeen = 0
+
+    def leafCount(self) -> int:
+        return len(self.stats)
+
+    # Learns one row
+    def learn(self, instance: Dict[str, str]) -> None:
+        self.learnBatch([instance])
+
+    # Learns a batch of rows: they are sent down to their leaves first, then each leaf adds up its rows
+    # and checks for a split once
+    def learnBatch(self, instances: Iterable[Dict[str, str]]) -> None:
+        groups = {}
+        for instance in instances:
+            if instance[self.targetAttribute] is None:
+                continue
+            leaf = self.leafFor(instance)
+            if leaf is not None:
+                groups.setdefault(id(leaf), (leaf, []))[1].append(instance)
+        for leaf, rows in groups.values():
+            stats = self.stats[id(leaf)]
+            classCounts = stats.classCounts
+            for instance in rows:
+                target = instance[self.targetAttribute]
+                classCounts[target] = classCounts.get(target, 0) + 1
+                for attr in stats.attributes:
+                    valueCounts = stats.tables[attr].setdefault(instance[attr], {})
+                    valueCounts[target] = valueCounts.get(target, 0) + 1
+            self.rowsSeen += len(rows)
+            # the leaf predicts the most common class it has seen, ties go to the class seen first
+            leaf.value = leaf.default = max(classCounts, key=classCounts.get)
+            stats.sinceCheck += len(rows)
+            if stats.sinceCheck >= self.gracePeriod:
+                stats.sinceCheck = 0
+                self.trySplit(leaf, stats)
+
+    # Learns every row of an ArffStream, batchSize rows at a time
+    def learnStream(self, stream, batchSize: int = 1000) -> None:
+        for chunk in stream.chunks(batchSize):
+            self.learnBatch(chunk.instances())
+
+    # The leaf a row ends up in while learning. A value a split has no child for gets a new leaf (while
+    # there is room for one), rows missing the value of a split can't go anywhere and give None
+    def leafFor(self, instance: Dict[str, str]) -> Optional[Node]:
+        node = self.root
+        while not node.isLeaf:
+            value = instance[node.attribute]
+            if value is None:
+                return None
+            child = node.children.get(value)
+            if child is None:
+                if self.leafCount() >= self.maxLeaves:
+                    return None
+                child = node.children[value] = self.newLeaf(node)
+            node = child
+        return node
+
+    # A leaf under a split that predicts the split's majority class until it sees rows of its own
+    def newLeaf(self, parent: Node) -> Node:
+        leaf = Node(isLeaf=True, value=parent.default)
+        self.stats[id(leaf)] = LeafStats(self.splitAttributes[id(parent)])
+        return leaf
+
+    # Hoeffding bound: with probability 1 - delta the true mean of a value with this range is within
+    # epsilon of the mean of rowCount observations
+    def hoeffdingBound(self, rowCount: int) -> float:
+        return math.sqrt(self.gainRange * self.gainRange * math.log(1 / self.delta) / (2 * rowCount))
+
+    # Splits a leaf on its best attribute if the bound says the rows seen so far are enough to pick it
+    def trySplit(self, leaf: Node, stats: LeafStats) -> None:
+        if len(stats.classCounts) < 2 or not stats.attributes:
+            return
+        gains = [countsGain(stats.classCounts, stats.tables[attr]) for attr in stats.attributes]
+        order = sorted(range(len(gains)), key=lambda i: -gains[i])
+        bestGain = gains[order[0]]
+        # with only one attribute left the other choice is not splitting at all
+        secondGain = gains[order[1]] if len(order) > 1 else 0.0
+        epsilon = self.hoeffdingBound(sum(stats.classCounts.values()))
+        if bestGain <= 0 or (bestGain - secondGain <= epsilon and epsilon >= self.tieThreshold):
+            return
+        bestAttribute = stats.attributes[order[0]]
+
+        # one child for every declared value and every value the leaf has seen
+        values = list(self.header.dictionaries[bestAttribute].values)
+        values += [value for value in stats.tables[bestAttribute] if value is not None and value not in values]
+        if self.leafCount() - 1 + len(values) > self.maxLeaves:
+            return
+        leaf.isLeaf = False
+        leaf.attribute = bestAttribute
+        self.splitAttributes[id(leaf)] = [attr for attr in stats.attributes if attr != bestAttribute]
+        for value in values:
+            leaf.children[value] = self.newLeaf(leaf)
+        # the split's counts aren't needed anymore
+        del self.stats[id(leaf)]
+
+    # Predicts class for a single instance
+    def predict(self, instance: Dict[str, str]) -> str:
+        node = self.root
+        while not node.isLeaf:
+            value = instance[node.attribute]
+            # If we haven't seen this value at this node return the node's majority class
+            if value not in node.children:
+                return node.default
+            node = node.children[value]
+        return node.value
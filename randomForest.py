@@ -0,0 +1,107 @@
+"""
+Name: Rowan Noel-Rickert
+
+A random forest of ID3 trees.  Every tree is grown by ID3.buildTree on a bootstrap sample of the
+training rows (only row numbers, the Data is never copied) and picks each split from a random subset
+of the attributes.  The trees are trained in worker processes that all read the one model they get
+when they start (with fork they share the parent's memory), and the forest predicts a whole Data at
+once: every tree routes all the rows through its compiled arrays and the votes are added up per row.
+"""
+import math
+import multiprocessing
+import random
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import add, and_, rshift
+from typing import Dict, List, Optional
+from ID3 import ID3, CompiledTree, Node
+
+# The model every worker process trains its trees with
+_workerModel = None
+
+
+def _initWorker(model: ID3):
+    global _workerModel
+    _workerModel = model
+
+
+# Trains one tree on a bootstrap sample drawn with seed (run in a worker, or in this process)
+def _trainTree(seed: int) -> Node:
+    model = _workerModel
+    rng = random.Random(seed)
+    rowCount = len(model.targetCodes)
+    model.random = rng
+    return model.train(rows=rng.choices(range(rowCount), k=rowCount))
+
+
+class RandomForest:
+    # trees is how many trees to grow, attributesPerNode how many attributes each split picks from
+    # (by default the square root of the number of attributes), workers how many processes train them
+    # The same seed gives the same forest for any number of workers
+    def __init__(self, data, targetAttribute: str, trees: int = 25, maxDepth=10, minSamples=5,
+                 attributesPerNode: Optional[int] = None, seed=None, workers: int = 1):
+        if trees < 1:
+            raise ValueError("A forest needs at least 1 tree")
+        self.data = data
+        self.targetAttribute = targetAttribute
+        self.treeCount = trees
+        self.workers = workers
+        self.seed = seed
+        self.model = ID3(data, targetAttribute, maxDepth, minSamples)
+        if attributesPerNode is None:
+            attributesPerNode = max(1, math.ceil(math.sqrt(len(self.model.attributes))))
+        self.model.attributesPerNode = attributesPerNode
+        self.targetDictionary = self.model.targetDictionary
+        self.trees: List[Node] = []
+        self.compiled: List[CompiledTree] = []
+
+    # Grows every tree, in self.workers processes when that is more than 1
+    def train(self) -> List[Node]:
+        rng = random.Random(self.seed)
+        seeds = [rng.randrange(2 ** 32) for _ in range(self.treeCount)]
+        # the numeric attributes are sorted once here, before the workers start, and every tree's sample
+        # takes its sorted orders from these
+        self.model.presortAll()
+        if self.workers > 1:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork') if 'fork' in methods else None
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                     initializer=_initWorker, initargs=(self.model,)) as pool:
+                self.trees = list(pool.map(_trainTree, seeds))
+        else:
+            _initWorker(self.model)
+            self.trees = [_trainTree(seed) for seed in seeds]
+        self.compiled = [self.model.compile(tree) for tree in self.trees]
+        return self.trees
+
+    # Predicts the class of one instance by majority vote, ties go to the class declared first
+    def predict(self, instance: Dict[str, str]) -> str:
+        votes = Counter(self.model.predict(tree, instance) for tree in self.trees)
+        return max(self.targetDictionary.values, key=lambda value: votes[value])
+
+    # Class codes the forest predicts for every row of data
+    # The votes of a row are packed into one int, with a field of bits per class, so adding a tree's
+    # predictions to every row is a single map. Ties go to the class declared first
+    def predictCodes(self, data) -> array:
+        classCount = len(self.targetDictionary)
+        bits = self.treeCount.bit_length()
+        weights = [1 << (code * bits) for code in range(classCount)]
+        votes = [0] * data.rowCount()
+        for compiled in self.compiled:
+            votes = list(map(add, votes, map(weights.__getitem__, compiled.predictCodes(data))))
+
+        # each row's best (votes, class) is found with one max over the classes, by turning the votes of
+        # class code c into votes * classCount + (classCount - 1 - c)
+        mask = (1 << bits) - 1
+        keys = []
+        for code in range(classCount):
+            counts = map(and_, map(rshift, votes, repeat(code * bits)), repeat(mask))
+            keys.append(list(map(add, map(classCount.__rmul__, counts), repeat(classCount - 1 - code))))
+        best = map(max, *keys) if classCount > 1 else keys[0]
+        return array('i', [classCount - 1 - key % classCount for key in best])
+
+    # Predicted class of every row in data
+    def predictBatch(self, data) -> List[str]:
+        return list(map(self.targetDictionary.values.__getitem__, self.predictCodes(data)))